@@ -0,0 +1,93 @@
+"""
+Payload size and latency of an aggregate computed by the database with
+$apply, compared with downloading the detail rows it is computed from.
+
+    python benchmarks/apply_aggregation.py --table OrderDetails \
+        --apply "groupby((ProductID), aggregate(Quantity with sum as Total, \$count as Lines))" \
+        --repeat 20
+
+Connects to the database of `active_dialect` in config.json. The detail read
+fetches the columns the transformations use, as a client aggregating on its
+own side would have to; both reads go through `stream_odata` and are
+serialized to JSON as the server does.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from db import DB
+from odata.apply import parse_apply
+from pool_startup import NullAnalytics
+
+
+def used_columns(node, columns, found):
+    """Columns of the table referenced anywhere in a parsed $apply"""
+
+    if isinstance(node, tuple):
+        if len(node) == 2 and node[0] == "col" and node[1] in columns:
+            found.add(node[1])
+        for item in node:
+            used_columns(item, columns, found)
+    elif isinstance(node, str) and node in columns:
+        found.add(node)
+    return found
+
+
+def timed_read(db, table, params, repeat):
+    """Best and mean time of a full read, its row count and its JSON size"""
+
+    times = []
+    rows = size = 0
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = db.stream_odata(table, params)
+        columns = result["columns"]
+        rows = size = 0
+        for batch in result["batches"]:
+            rows += len(batch)
+            size += len(json.dumps([dict(zip(columns, row)) for row in batch], default=str))
+        times.append(time.perf_counter() - start)
+
+    return min(times), sum(times) / len(times), rows, size
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--apply", action="append", required=True)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        cfg = json.load(f)
+
+    cfg["odata"]["pool_min_size"] = 1
+    db = DB(cfg, NullAnalytics(), [args.table])
+    table_columns = db.get_table(args.table)["columns"]
+
+    print(f"{'read':<8} {'rows':>8} {'bytes':>11} {'best (ms)':>10} {'mean (ms)':>10}")
+
+    for apply in args.apply:
+        steps, _ = parse_apply(apply)
+        select = sorted(used_columns(steps, table_columns, set()))
+
+        print(f"\n$apply={apply}")
+        reads = (
+            ("detail", {"$select": ",".join(select)} if select else {}),
+            ("$apply", {"$apply": apply}),
+        )
+
+        for name, params in reads:
+            best, mean, rows, size = timed_read(db, args.table, params, args.repeat)
+            print(f"{name:<8} {rows:>8} {size:>11} {best * 1000:>10.2f} {mean * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
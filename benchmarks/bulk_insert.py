@@ -0,0 +1,83 @@
+"""
+Rows per second loading the same rows one POST per row, as one JSON array
+and as one NDJSON body.
+
+    python benchmarks/bulk_insert.py --user user1 --password 123 \
+        --path "/odata/sqlserver/get_data_employees" \
+        --row '{"LastName": "Bench", "FirstName": "Row"}' --rows 5000
+
+The rows are really inserted: point it at a scratch table or clean up after.
+With --method PATCH the same bodies go through the bulk upsert instead.
+"""
+import argparse
+import json
+import sys
+import time
+from http.client import HTTPConnection
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from mixed_load import login
+
+
+def send(conn, method, path, body, headers):
+    conn.request(method, path, body=body, headers=headers)
+    resp = conn.getresponse()
+    data = resp.read()
+    if resp.status != 200:
+        raise RuntimeError(f"{resp.status}: {data[:200]}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--row", required=True, help="JSON object inserted repeatedly")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--method", default="POST", choices=["POST", "PATCH"])
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        server_cfg = json.load(f)["server"]
+
+    def make_conn():
+        return HTTPConnection(
+            server_cfg["internal_host"], server_cfg["internal_port"], timeout=600
+        )
+
+    token = login(make_conn, args.user, args.password)
+    auth = {"Authorization": f"Bearer {token}"}
+    row = json.loads(args.row)
+    conn = make_conn()
+
+    def timed(name, run):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<12} {elapsed:>9.2f} s {args.rows / elapsed:>12.0f} rows/s")
+
+    def one_by_one():
+        body = json.dumps(row)
+        headers = {**auth, "Content-Type": "application/json"}
+        for _ in range(args.rows):
+            send(conn, args.method, args.path, body, headers)
+
+    def array():
+        headers = {**auth, "Content-Type": "application/json"}
+        send(conn, args.method, args.path, json.dumps([row] * args.rows), headers)
+
+    def ndjson():
+        headers = {**auth, "Content-Type": "application/x-ndjson"}
+        send(conn, args.method, args.path, "\n".join([json.dumps(row)] * args.rows), headers)
+
+    timed("one by one", one_by_one)
+    timed("array", array)
+    timed("ndjson", ndjson)
+
+
+if __name__ == "__main__":
+    main()
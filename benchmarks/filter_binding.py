@@ -0,0 +1,107 @@
+"""
+Plans and latency of $filter queries with the literals bound as typed values,
+as the server binds them, compared with the same literals bound as strings.
+
+    python benchmarks/filter_binding.py --table orders \
+        --filter "OrderID eq 10250" --filter "OrderDate ge 1998-05-01" --repeat 200
+
+Connects to the database of `active_dialect` in config.json and prints the
+plan of each query (EXPLAIN, or SHOWPLAN_TEXT on SQL Server), so a scan
+caused by an implicit conversion shows up next to the seek it replaces.
+Postgres plans are taken with sequential scans disabled, so a small table
+still shows whether its index can be used. tests/test_index_seeks.py checks
+that the typed plans seek.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from db import DB
+from pool_startup import NullAnalytics
+
+def explain(db, sql, params):
+    conn = db.adapter.acquire()
+    cur = conn.cursor()
+
+    try:
+        if db.cfg["active_dialect"] == "mssql":
+            cur.execute("SET SHOWPLAN_TEXT ON")
+            try:
+                cur.execute(sql, params)
+                lines = []
+                while True:
+                    lines += [str(row[0]) for row in cur.fetchall()]
+                    if not cur.nextset():
+                        break
+            finally:
+                cur.execute("SET SHOWPLAN_TEXT OFF")
+        elif db.cfg["active_dialect"] == "mysql":
+            cur.execute("EXPLAIN " + sql, params)
+            names = [d[0] for d in cur.description]
+            lines = [
+                " ".join(f"{n}={v}" for n, v in (row.items() if isinstance(row, dict) else zip(names, row)))
+                for row in cur.fetchall()
+            ]
+        else:
+            cur.execute("SET enable_seqscan = off")
+            try:
+                cur.execute("EXPLAIN " + sql, params)
+                lines = [" | ".join(str(v) for v in row) for row in cur.fetchall()]
+            finally:
+                cur.execute("RESET enable_seqscan")
+    finally:
+        cur.close()
+        db.adapter.release(conn)
+
+    return lines
+
+
+def timed(db, sql, params, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        db.execute(sql, params)
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--filter", action="append", required=True)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        cfg = json.load(f)
+
+    cfg["odata"]["pool_min_size"] = 1
+    db = DB(cfg, NullAnalytics(), [args.table])
+
+    for filter_str in args.filter:
+        key, literals = db._query_shape(args.table, {"$filter": filter_str})
+        sql, slots, converters, _ = db._build_plan(args.table, key)
+
+        text = [literals[i] for i in slots]
+        typed = [v if convert is None else convert(v) for v, convert in zip(text, converters)]
+
+        print(f"\n$filter={filter_str}")
+        print(sql)
+
+        for name, params in (("typed", typed), ("string", text)):
+            best, mean = timed(db, sql, params, args.repeat)
+            plan = explain(db, sql, params)
+            print(f"\n  {name:<7} {params!r}")
+            print(f"  best {best * 1000:.2f} ms, mean {mean * 1000:.2f} ms")
+            for line in plan:
+                print(f"    {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Cost of parsing and compiling long $filter expressions, without a database.
+
+    python benchmarks/filter_parser.py --clauses 10 50 200 --repeat 200
+
+Each expression ORs together `--clauses` groups of a comparison, a
+`contains` and an `in` list. Parsing runs on every request; compiling runs
+once per shape, after that the plan cache answers.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from odata.filter import parse_filter, compile_filter
+
+COLUMNS = {
+    "OrderID": {"type": "int"},
+    "ShipName": {"type": "nvarchar"},
+    "ShipCountry": {"type": "nvarchar"},
+    "Freight": {"type": "money"},
+    "OrderDate": {"type": "datetime"},
+}
+
+
+def expression(clauses):
+    return " or ".join(
+        f"(OrderID gt {i} and contains(ShipName, 'ship {i}') "
+        f"and ShipCountry in ('A{i}', 'B{i}', 'C{i}') and OrderDate ge 1998-05-01)"
+        for i in range(clauses)
+    )
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clauses", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--dialect", default="mssql")
+    args = parser.parse_args()
+
+    print(f"{'clauses':>8} {'chars':>7} {'literals':>9} {'parse (ms)':>11} "
+          f"{'compile (ms)':>13} {'us/char':>8}")
+
+    for clauses in args.clauses:
+        text = expression(clauses)
+        tree, literals = parse_filter(text)
+
+        parse = timed(lambda: parse_filter(text), args.repeat)
+        compile_ = timed(lambda: compile_filter(tree, COLUMNS, args.dialect), args.repeat)
+
+        print(f"{clauses:>8} {len(text):>7} {len(literals):>9} {parse * 1000:>11.3f} "
+              f"{compile_ * 1000:>13.3f} {parse * 1e6 / len(text):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
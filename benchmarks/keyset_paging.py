@@ -0,0 +1,81 @@
+"""
+Per-page latency of walking a whole table with $skiptoken (keyset) paging
+compared with $skip (OFFSET) paging.
+
+    python benchmarks/keyset_paging.py --user user1 --password 123 \
+        --path "/odata/sqlserver/get_data_orders" --page-size 1000
+
+The endpoint must have `max_page_rows` and `primary_key` set in
+endpoints.json. The keyset walk follows `@odata.nextLink` until the last page,
+then the same pages are requested again with `$top`/`$skip`.
+"""
+import argparse
+import json
+import sys
+import time
+from http.client import HTTPConnection
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from mixed_load import login
+
+
+def fetch(conn, path, headers):
+    start = time.perf_counter()
+    conn.request("GET", path, headers=headers)
+    body = json.loads(conn.getresponse().read())
+    return time.perf_counter() - start, body
+
+
+def report(name, latencies, every):
+    print(f"\n{name}")
+    print(f"{'page':>6} {'ms':>9}")
+    for i in range(0, len(latencies), every):
+        print(f"{i + 1:>6} {latencies[i] * 1000:>9.1f}")
+    print(f"{len(latencies):>6} {latencies[-1] * 1000:>9.1f}  (last)")
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--page-size", type=int, required=True)
+    parser.add_argument("--every", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        server_cfg = json.load(f)["server"]
+
+    def make_conn():
+        return HTTPConnection(
+            server_cfg["internal_host"], server_cfg["internal_port"], timeout=300
+        )
+
+    token = login(make_conn, args.user, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+    conn = make_conn()
+
+    keyset = []
+    path = args.path
+    while path:
+        elapsed, body = fetch(conn, path, headers)
+        keyset.append(elapsed)
+        path = body.get("@odata.nextLink")
+
+    offset = []
+    sep = "&" if "?" in args.path else "?"
+    for page in range(len(keyset)):
+        path = f"{args.path}{sep}$top={args.page_size}&$skip={page * args.page_size}"
+        elapsed, _ = fetch(conn, path, headers)
+        offset.append(elapsed)
+
+    report("$skiptoken", keyset, args.every)
+    report("$skip", offset, args.every)
+
+
+if __name__ == "__main__":
+    main()
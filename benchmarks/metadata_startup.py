@@ -0,0 +1,69 @@
+"""
+Metadata load time at startup: the whole catalog, only the endpoint tables,
+and the endpoint tables served from the on-disk metadata cache.
+
+    python benchmarks/metadata_startup.py --repeat 5
+
+Connects to the database of `active_dialect` in config.json and takes the
+tables from security/endpoints.json. The metadata cache is written to a
+temporary file, the real one is not touched.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH, SECURITY_PATH
+from db import DB
+from pool_startup import NullAnalytics
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        cfg = copy.deepcopy(json.load(f))
+
+    with open(SECURITY_PATH / "endpoints.json") as f:
+        tables = [ep["source"] for ep in json.load(f)["endpoints"] if ep.get("source")]
+
+    cache_file = Path(tempfile.mkdtemp()) / "metadata_cache.json"
+    cfg["odata"]["metadata_cache_file"] = str(cache_file)
+    cfg["odata"]["pool_min_size"] = 1
+
+    uncached = copy.deepcopy(cfg)
+    uncached["odata"]["metadata_cache"] = False
+
+    runs = {
+        "full catalog": (DB(uncached, NullAnalytics()), None),
+        "endpoint tables": (DB(uncached, NullAnalytics(), tables), None),
+        "cold cache": (DB(cfg, NullAnalytics(), tables), cache_file),
+        "warm cache": (DB(cfg, NullAnalytics(), tables), None),
+    }
+
+    print(f"{'load':<16} {'tables':>7} {'best (ms)':>10} {'mean (ms)':>10}")
+
+    for name, (db, remove) in runs.items():
+        times = []
+        for _ in range(args.repeat):
+            if remove and remove.exists():
+                os.remove(remove)
+            start = time.perf_counter()
+            db.load_metadata()
+            times.append(time.perf_counter() - start)
+
+        print(f"{name:<16} {len(db.meta.tables):>7} "
+              f"{min(times) * 1000:>10.1f} {sum(times) / len(times) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
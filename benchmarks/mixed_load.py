@@ -0,0 +1,131 @@
+"""
+Mixed light/heavy load against the internal server, reporting latency
+percentiles per query kind.
+
+    python benchmarks/mixed_load.py --user user1 --password 123 \
+        --light "/odata/sqlserver/get_data_employees?\$top=10" \
+        --heavy "/odata/sqlserver/get_data_orders_detail" \
+        --light-users 50 --heavy-users 10 --seconds 60
+
+Run it once with `odata.lanes` removed from config.json and once with the
+lanes configured to compare the light-query p95 with and without bulkheads.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+
+
+def login(make_conn, user, password):
+    conn = make_conn()
+    conn.request(
+        "POST", "/login",
+        body=json.dumps({"username": user, "password": password}),
+        headers={"Content-Type": "application/json"}
+    )
+    return json.loads(conn.getresponse().read())["access_token"]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(make_conn, token, paths, seconds):
+    """
+    `paths` maps a kind to (path, users). Returns the latencies per kind and
+    the error count.
+    """
+
+    latencies = {kind: [] for kind in paths}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def worker(kind, path):
+        conn = make_conn()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+            except Exception:
+                ok = False
+                conn.close()
+                conn = make_conn()
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                if ok:
+                    latencies[kind].append(elapsed)
+                else:
+                    errors[0] += 1
+        conn.close()
+
+    threads = [
+        threading.Thread(target=worker, args=(kind, path))
+        for kind, (path, users) in paths.items()
+        for _ in range(users)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return latencies, errors[0]
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--light", required=True, help="path of a light query")
+    parser.add_argument("--heavy", required=True, help="path of a heavy query")
+    parser.add_argument("--light-users", type=int, default=50)
+    parser.add_argument("--heavy-users", type=int, default=10)
+    parser.add_argument("--seconds", type=int, default=60)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        server_cfg = json.load(f)["server"]
+
+    def make_conn():
+        return HTTPConnection(
+            server_cfg["internal_host"], server_cfg["internal_port"], timeout=120
+        )
+
+    token = login(make_conn, args.user, args.password)
+
+    latencies, errors = run(
+        make_conn,
+        token,
+        {
+            "light": (args.light, args.light_users),
+            "heavy": (args.heavy, args.heavy_users),
+        },
+        args.seconds
+    )
+
+    print(f"{'kind':<6} {'requests':>9} {'rps':>7} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}")
+    for kind, values in latencies.items():
+        print(f"{kind:<6} {len(values):>9} {len(values) / args.seconds:>7.1f} "
+              f"{percentile(values, 50) * 1000:>9.1f} {percentile(values, 95) * 1000:>9.1f} "
+              f"{percentile(values, 99) * 1000:>9.1f}")
+    print(f"errors: {errors}")
+
+
+if __name__ == "__main__":
+    main()
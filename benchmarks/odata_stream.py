@@ -0,0 +1,84 @@
+"""
+Time-to-first-byte, total time and server peak RSS of a large OData GET.
+
+    python benchmarks/odata_stream.py --user user1 --password 123 \
+        --path "/odata/sqlserver/get_data_orders_detail?\$top=100000" --pid <server pid>
+
+Run it against the previous release and the current one to compare the
+buffered and the streaming response paths. With --pid the RSS of the server
+process is sampled while the requests are running.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+from pathlib import Path
+
+import psutil
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from mixed_load import login
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--pid", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        server_cfg = json.load(f)["server"]
+
+    def make_conn():
+        return HTTPConnection(
+            server_cfg["internal_host"], server_cfg["internal_port"], timeout=300
+        )
+
+    token = login(make_conn, args.user, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    peak = [0]
+    stop = threading.Event()
+
+    if args.pid:
+        process = psutil.Process(args.pid)
+        baseline = process.memory_info().rss
+
+        def sample():
+            while not stop.is_set():
+                peak[0] = max(peak[0], process.memory_info().rss)
+                time.sleep(0.01)
+
+        threading.Thread(target=sample, daemon=True).start()
+
+    print(f"{'run':>4} {'ttfb (ms)':>10} {'total (ms)':>11} {'MB':>8}")
+
+    conn = make_conn()
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        conn.request("GET", args.path, headers=headers)
+        resp = conn.getresponse()
+        size = len(resp.read(1))
+        ttfb = time.perf_counter() - start
+        while data := resp.read(65536):
+            size += len(data)
+        total = time.perf_counter() - start
+
+        print(f"{i + 1:>4} {ttfb * 1000:>10.1f} {total * 1000:>11.1f} {size / 2**20:>8.2f}")
+
+    stop.set()
+
+    if args.pid:
+        print(f"server peak RSS growth: {(peak[0] - baseline) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Time from DB initialization to the first served OData query, for several
+pool warm-up settings.
+
+    python benchmarks/pool_startup.py --table Orders --min-sizes 0 4 20
+
+Connects to the database of `active_dialect` in config.json. A min size equal
+to `pool_size` reproduces the old behavior of opening the whole pool up front.
+"""
+import argparse
+import copy
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from db import DB
+
+
+class NullAnalytics:
+
+    def capture_error(self, *args, **kwargs):
+        pass
+
+    def capture(self, *args, **kwargs):
+        pass
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", default="Orders")
+    parser.add_argument("--min-sizes", type=int, nargs="+", default=[0, 4, 20])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        base_cfg = json.load(f)
+
+    print(f"{'min_size':>8} {'workers':>8} {'init (ms)':>10} {'first query (ms)':>17}")
+
+    for min_size in args.min_sizes:
+        for workers in args.workers:
+            cfg = copy.deepcopy(base_cfg)
+            cfg["odata"]["pool_min_size"] = min_size
+            cfg["odata"]["pool_warmup_workers"] = workers
+
+            start = time.perf_counter()
+            db = DB(cfg, NullAnalytics())
+            ready = time.perf_counter()
+            db.query_odata(args.table, {"$top": "1"})
+            served = time.perf_counter()
+
+            print(f"{min_size:>8} {workers:>8} {(ready - start) * 1000:>10.1f} "
+                  f"{(served - start) * 1000:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
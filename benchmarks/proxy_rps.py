@@ -0,0 +1,97 @@
+"""
+Throughput of the HTTPS proxy versus hitting waitress directly.
+
+    python benchmarks/proxy_rps.py --path /version --clients 50 --seconds 20
+
+Both targets are read from config.json (`server` section), so the server must
+be running from the GUI before launching the benchmark.
+"""
+import argparse
+import json
+import ssl
+import sys
+import threading
+import time
+from http.client import HTTPConnection, HTTPSConnection
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+
+
+def run(make_conn, path, headers, clients, seconds):
+
+    done = [0] * clients
+    errors = [0] * clients
+    deadline = time.perf_counter() + seconds
+
+    def worker(i):
+        conn = make_conn()
+        while time.perf_counter() < deadline:
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                done[i] += 1
+                if resp.will_close:
+                    conn.close()
+                    conn = make_conn()
+            except Exception:
+                errors[i] += 1
+                conn.close()
+                conn = make_conn()
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return sum(done) / elapsed, sum(errors)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="/version")
+    parser.add_argument("--token", default=None, help="JWT for /odata paths")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seconds", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        server_cfg = json.load(f)["server"]
+
+    headers = {}
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+
+    host = server_cfg["public_host"]
+    if host == "0.0.0.0":
+        host = "127.0.0.1"
+
+    targets = {
+        "waitress": lambda: HTTPConnection(
+            server_cfg["internal_host"], server_cfg["internal_port"], timeout=30
+        ),
+        "proxy": lambda: HTTPSConnection(
+            host, server_cfg["public_port"], timeout=30, context=ctx
+        ),
+    }
+
+    print(f"{'target':<10} {'rps':>10} {'errors':>8}")
+    for name, make_conn in targets.items():
+        rps, errors = run(make_conn, args.path, headers, args.clients, args.seconds)
+        print(f"{name:<10} {rps:>10.1f} {errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Proxies a large download and a large upload through the HTTPS proxy and
+checks that the proxy memory stays under a ceiling, whatever the body size.
+
+    python benchmarks/proxy_stream_memory.py --size-mb 500 --ceiling-mb 64
+
+A local upstream server stands in for waitress, and the proxy runs in this
+same process with the certificate configured in config.json. The script exits
+with status 1 when the RSS growth goes above the ceiling.
+"""
+import argparse
+import ssl
+import sys
+import threading
+import time
+from http.client import HTTPSConnection
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+import psutil
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import proxy
+
+CHUNK = b"x" * 65536
+
+
+class Upstream(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    size = 0
+
+    def do_GET(self):
+        chunked = self.path.endswith("chunked")
+
+        self.send_response(200)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(self.size))
+        self.end_headers()
+
+        for _ in range(self.size // len(CHUNK)):
+            if chunked:
+                self.wfile.write(b"%X\r\n" % len(CHUNK) + CHUNK + b"\r\n")
+            else:
+                self.wfile.write(CHUNK)
+
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        body = proxy.RequestBody(
+            self.rfile,
+            length=int(self.headers.get("Content-Length", 0)),
+            chunked="chunked" in self.headers.get("Transfer-Encoding", "")
+        )
+        received = sum(len(data) for data in body)
+
+        payload = str(received).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sample_peak(stop, peak):
+    process = psutil.Process()
+    while not stop.is_set():
+        peak[0] = max(peak[0], process.memory_info().rss)
+        time.sleep(0.01)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=500)
+    parser.add_argument("--ceiling-mb", type=int, default=64)
+    parser.add_argument("--upstream-port", type=int, default=14545)
+    parser.add_argument("--proxy-port", type=int, default=15000)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    Upstream.size = size
+
+    upstream = ThreadingHTTPServer(("127.0.0.1", args.upstream_port), Upstream)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    server_cfg = dict(
+        proxy.server_cfg,
+        public_host="127.0.0.1",
+        public_port=args.proxy_port,
+        internal_host="127.0.0.1",
+        internal_port=args.upstream_port
+    )
+    threading.Thread(target=proxy.start_https_proxy, args=(server_cfg,), daemon=True).start()
+    time.sleep(0.5)
+
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+
+    baseline = psutil.Process().memory_info().rss
+    peak = [baseline]
+    stop = threading.Event()
+    threading.Thread(target=sample_peak, args=(stop, peak), daemon=True).start()
+
+    conn = HTTPSConnection("127.0.0.1", args.proxy_port, context=ctx, timeout=120)
+
+    for path in ("/download", "/download/chunked"):
+        start = time.perf_counter()
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        first = resp.read(1)
+        ttfb = time.perf_counter() - start
+        received = len(first)
+        while data := resp.read(65536):
+            received += len(data)
+        print(f"GET  {path:<18} {received / 2**20:8.1f} MB  ttfb {ttfb * 1000:7.1f} ms  "
+              f"total {time.perf_counter() - start:6.2f} s")
+
+    def upload():
+        for _ in range(size // len(CHUNK)):
+            yield CHUNK
+
+    for chunked in (False, True):
+        start = time.perf_counter()
+        headers = {} if chunked else {"Content-Length": str(size)}
+        conn.request("POST", "/upload", body=upload(), headers=headers, encode_chunked=chunked)
+        received = int(conn.getresponse().read())
+        print(f"POST {'chunked' if chunked else 'content-length':<18} {received / 2**20:8.1f} MB  "
+              f"total {time.perf_counter() - start:6.2f} s")
+
+    stop.set()
+    growth = (peak[0] - baseline) / 2**20
+    print(f"peak RSS growth {growth:.1f} MB (ceiling {args.ceiling_mb} MB)")
+
+    if growth > args.ceiling_mb:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Thundering herd: waves of identical GETs sent at the same instant, reporting
+latency percentiles and how many requests were coalesced.
+
+    python benchmarks/thundering_herd.py --user user1 --password 123 \
+        --path "/odata/sqlserver/get_data_orders?\$top=1000" --clients 50 --waves 20
+
+Run it with `coalesce_max_bytes` set to 0 in config.json and with the default
+to compare. Endpoints with a `cache_ttl` answer every wave after the first from
+the result cache, so use an endpoint without one.
+"""
+import argparse
+import base64
+import json
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from mixed_load import login, percentile
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--waves", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        cfg = json.load(f)
+        server_cfg = cfg["server"]
+        admin_user = cfg["security"]["admin_user"]
+
+    def make_conn():
+        return HTTPConnection(
+            server_cfg["internal_host"], server_cfg["internal_port"], timeout=300
+        )
+
+    def coalescing():
+        conn = make_conn()
+        auth = base64.b64encode(f"{admin_user}:".encode()).decode()
+        conn.request("GET", "/stats", headers={"Authorization": f"Basic {auth}"})
+        return json.loads(conn.getresponse().read())["coalescing"]
+
+    token = login(make_conn, args.user, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.clients)
+
+    def client():
+        conn = make_conn()
+        for _ in range(args.waves):
+            barrier.wait()
+            start = time.perf_counter()
+            try:
+                conn.request("GET", args.path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+            except Exception:
+                conn.close()
+                conn = make_conn()
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += not ok
+
+    before = coalescing()
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    after = coalescing()
+
+    print(f"requests: {len(latencies)}  errors: {errors[0]}")
+    for p in (50, 95, 99):
+        print(f"p{p}: {percentile(latencies, p) * 1000:.1f} ms")
+    print(f"executions: {after['leaders'] - before['leaders']}  "
+          f"shared: {after['shared'] - before['shared']}  "
+          f"fallbacks: {after['fallbacks'] - before['fallbacks']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Sustained single-row insert load: concurrent clients each POST one row at a
+time, reporting throughput and latency percentiles.
+
+    python benchmarks/write_load.py --user user1 --password 123 \
+        --path "/odata/sqlserver/get_data_employees" \
+        --row '{"LastName": "Bench", "FirstName": "Row"}' --clients 50 --seconds 30
+
+Run it with `coalesce_writes` off and on for the endpoint in endpoints.json to
+compare. The rows are really inserted.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import CONFIG_PATH
+from mixed_load import login, percentile
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--row", required=True, help="JSON object inserted repeatedly")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seconds", type=int, default=30)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        server_cfg = json.load(f)["server"]
+
+    def make_conn():
+        return HTTPConnection(
+            server_cfg["internal_host"], server_cfg["internal_port"], timeout=300
+        )
+
+    token = login(make_conn, args.user, args.password)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    body = args.row
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def client():
+        conn = make_conn()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request("POST", args.path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+            except Exception:
+                conn.close()
+                conn = make_conn()
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += not ok
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"inserts: {len(latencies)}  errors: {errors[0]}  "
+          f"rows/s: {len(latencies) / args.seconds:.0f}")
+    for p in (50, 95, 99):
+        print(f"p{p}: {percentile(latencies, p) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
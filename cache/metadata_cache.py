@@ -0,0 +1,58 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+APP_NAME = "PulseConnector"
+METADATA_FILE = "metadata_cache.json"
+
+
+def default_metadata_path():
+    if sys.platform.startswith("win"):
+        base = Path(os.getenv("APPDATA") or Path.home()) / APP_NAME
+    else:
+        base = Path.home() / ".config" / APP_NAME
+
+    return base / METADATA_FILE
+
+
+class MetadataCache:
+    """
+    Catalog rows of the last metadata load of each database, stored on disk
+    together with the schema fingerprint they were read under. A start whose
+    fingerprint still matches reuses them instead of scanning the catalog.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_metadata_path()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+    def load(self, key, fingerprint):
+        entry = self._read().get(key)
+
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return None
+
+        return entry["rows"]
+
+    def save(self, key, fingerprint, rows):
+        with self.lock:
+            state = self._read()
+            state[key] = {"fingerprint": fingerprint, "rows": [list(r) for r in rows]}
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(state, default=str))
+            os.replace(tmp, self.path)
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text())
+        except Exception:
+            return {}
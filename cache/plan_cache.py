@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+
+
+class PlanCache:
+    """
+    Bounded LRU of compiled OData query plans.
+
+    Keys are built from the table and the shape of the query options, with
+    the literal values left out, so every request with the same shape reuses
+    the same SQL text. A size of 0 disables the cache.
+
+    Clearing the cache bumps its epoch; a plan built before the clear carries
+    the older epoch and is not stored.
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self.lock = threading.Lock()
+        self.plans = OrderedDict()
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            plan = self.plans.get(key)
+
+            if plan is None:
+                self.misses += 1
+                return None
+
+            self.plans.move_to_end(key)
+            self.hits += 1
+            return plan
+
+    def put(self, key, plan, epoch):
+        if self.size <= 0:
+            return
+
+        with self.lock:
+            if epoch != self.epoch:
+                return
+
+            self.plans[key] = plan
+            self.plans.move_to_end(key)
+
+            while len(self.plans) > self.size:
+                self.plans.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.plans.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": self.size,
+                "entries": len(self.plans),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
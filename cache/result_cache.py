@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    LRU of serialized OData GET responses, bounded by the total size of the
+    cached bodies.
+
+    Every entry belongs to a table and expires after the TTL given when it is
+    stored. A write to a table drops its entries and bumps the table
+    generation; a response read before the write carries the older
+    generation and is not stored. A size of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, max_entry_bytes=4 * 2**20):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tables = {}
+        self.generations = {}
+        self.epoch = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def generation(self, table):
+        with self.lock:
+            return self.epoch, self.generations.get(table, 0)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            body, table, expires = entry
+            if expires <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, table, body, ttl, generation):
+        if self.max_bytes <= 0 or len(body) > self.max_entry_bytes:
+            return
+
+        with self.lock:
+            if (self.epoch, self.generations.get(table, 0)) != generation:
+                return
+
+            if key in self.entries:
+                self._drop(key)
+
+            self.entries[key] = (body, table, time.monotonic() + ttl)
+            self.tables.setdefault(table, set()).add(key)
+            self.bytes += len(body)
+
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, table):
+        with self.lock:
+            self.generations[table] = self.generations.get(table, 0) + 1
+
+            for key in self.tables.pop(table, ()):
+                body, _, _ = self.entries.pop(key)
+                self.bytes -= len(body)
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+            self.tables.clear()
+            self.bytes = 0
+
+    def _drop(self, key):
+        body, table, _ = self.entries.pop(key)
+        self.bytes -= len(body)
+
+        keys = self.tables[table]
+        keys.discard(key)
+        if not keys:
+            del self.tables[table]
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "max_bytes": self.max_bytes,
+                "bytes": self.bytes,
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,80 @@
+import threading
+import time
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.started = time.monotonic()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls. The first caller of a key is the
+    leader and runs the call; callers arriving while it is in flight wait for
+    the leader and share its result or its error.
+
+    A leader may finish without a result (for instance when it is too big to
+    share), and a follower gives up after `timeout` seconds; in both cases
+    `wait` returns None and the follower runs the call itself.
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.leaders = 0
+        self.shared = 0
+        self.fallbacks = 0
+
+    def begin(self, key):
+        """
+        Returns (call, leader). The leader must always end the call with
+        `finish`; a call left open longer than `timeout` is replaced by a new
+        leader.
+        """
+
+        with self.lock:
+            call = self.calls.get(key)
+
+            if call is None or time.monotonic() - call.started > self.timeout:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+                return call, True
+
+            return call, False
+
+    def wait(self, call):
+        done = call.done.wait(self.timeout)
+
+        with self.lock:
+            if not done or (call.result is None and call.error is None):
+                self.fallbacks += 1
+                return None
+            self.shared += 1
+
+        if call.error is not None:
+            raise call.error
+
+        return call.result
+
+    def finish(self, key, call, result=None, error=None):
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "fallbacks": self.fallbacks
+            }
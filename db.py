@@ -1,11 +1,32 @@
 # db.py
+import hashlib
+import threading
+import time
+import uuid
 from sqlalchemy import MetaData, inspect
 from db_pool import MSSQLAdapter, MySQLAdapter, PostgresAdapter
+from cache.plan_cache import PlanCache
+from cache.result_cache import ResultCache
+from cache.single_flight import SingleFlight
+from cache.metadata_cache import MetadataCache
+from odata.skiptoken import encode_skiptoken, decode_skiptoken, InvalidSkiptoken
+from odata.literals import InvalidQuery, literal_converter
+from odata.filter import parse_filter, compile_filter
+from odata.apply import parse_apply, compile_apply
+from write_coalescer import WriteCoalescer
+from schema_watcher import SchemaWatcher
 from analytics.logger import setup_logger
 
 log = setup_logger()
 
 
+# column types the dialect cannot sort by
+UNSORTABLE_TYPES = {
+    "mssql": {"text", "ntext", "image", "xml"},
+    "postgres": {"json", "xml"},
+}
+
+
 class Meta:
     def __init__(self):
         self.tables = {}
@@ -13,10 +34,49 @@ class Meta:
 
 class DB:
 
-    def __init__(self, cfg, analytics):
+    def __init__(self, cfg, analytics, tables=None):
+        """
+        `tables` limits the metadata to the tables the endpoints expose;
+        without it every table of the database is loaded.
+        """
+
         self.cfg = cfg
         self.meta = Meta()
         self.analytics = analytics
+        self.tables = sorted(set(tables)) if tables else None
+
+        self.metadata_cache = None
+        if cfg["odata"].get("metadata_cache", True):
+            self.metadata_cache = MetadataCache(cfg["odata"].get("metadata_cache_file"))
+        self.plan_cache = PlanCache(cfg["odata"].get("plan_cache_size", 512))
+
+        # fingerprint of the schema the current metadata was read under
+        self.fingerprint = None
+        self.schema_watcher = SchemaWatcher(self, cfg["odata"].get("schema_watch_interval", 30))
+
+        # part of every ETag, so a restart never reuses the ETag of another run
+        self.instance = uuid.uuid4().hex
+        self.result_cache = ResultCache(
+            cfg["odata"].get("result_cache_bytes", 64 * 2**20),
+            cfg["odata"].get("result_cache_max_entry_bytes", 4 * 2**20)
+        )
+
+        # identical route reads in flight at the same time share one
+        # execution, bodies above coalesce_max_bytes are not shared (0
+        # disables it)
+        self.flights = SingleFlight(cfg["odata"].get("coalesce_timeout", 30))
+        self.coalesce_max_bytes = cfg["odata"].get("coalesce_max_bytes", 4 * 2**20)
+
+        # concurrent single-row inserts of endpoints with coalesce_writes
+        self.write_coalescer = WriteCoalescer(
+            self._flush_inserts,
+            cfg["odata"].get("write_coalesce_max_rows", 100),
+            cfg["odata"].get("write_coalesce_wait_ms", 5) / 1000
+        )
+
+        # observed average JSON size of a row per table, sizes byte-budgeted pages
+        self.row_bytes = {}
+        self.row_bytes_lock = threading.Lock()
 
         dialect = cfg["active_dialect"]
 
@@ -37,75 +97,233 @@ class DB:
 
 
     def load_metadata(self):
+        """
+        Loads the column metadata of the tables and returns True on success.
+        The catalog rows are kept on disk with a fingerprint of the schema,
+        and a load whose fingerprint is unchanged reads them from there
+        instead. On failure the previous metadata stays in place.
+        """
 
         dialect = self.cfg["active_dialect"]
         conn = self.adapter.acquire()
         cur = None
+        broken = False
 
         try:
             cur = conn.cursor()
 
-            if dialect == "mssql":
-                cur.execute("""
-                            SELECT c.TABLE_NAME,
-                                   c.COLUMN_NAME,
-                                   c.DATA_TYPE,
-                                   c.IS_NULLABLE,
-                                   CASE WHEN k.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_PK
-                            FROM INFORMATION_SCHEMA.COLUMNS c
-                                     LEFT JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE k
-                                               ON c.TABLE_NAME = k.TABLE_NAME
-                                                   AND c.COLUMN_NAME = k.COLUMN_NAME
-                                                   AND OBJECTPROPERTY(
-                                                               OBJECT_ID(k.CONSTRAINT_SCHEMA + '.' + k.CONSTRAINT_NAME),
-                                                               'IsPrimaryKey'
-                                                       ) = 1
-                            ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
-                            """)
-
-            elif dialect == "mysql":
-                cur.execute("""
-                            SELECT c.TABLE_NAME,
-                                   c.COLUMN_NAME,
-                                   c.DATA_TYPE,
-                                   c.IS_NULLABLE,
-                                   CASE WHEN k.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_PK
-                            FROM INFORMATION_SCHEMA.COLUMNS c
-                                     LEFT JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE k
-                                               ON c.TABLE_SCHEMA = k.TABLE_SCHEMA
-                                                   AND c.TABLE_NAME = k.TABLE_NAME
-                                                   AND c.COLUMN_NAME = k.COLUMN_NAME
-                                                   AND k.CONSTRAINT_NAME = 'PRIMARY'
-                            WHERE c.TABLE_SCHEMA = DATABASE()
-                            ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
-                            """)
-
-            elif dialect == "postgres":
-                cur.execute("""
-                            SELECT c.table_name,
-                                   c.column_name,
-                                   c.data_type,
-                                   c.is_nullable,
-                                   CASE WHEN tc.constraint_type = 'PRIMARY KEY' THEN 1 ELSE 0 END AS is_pk
-                            FROM information_schema.columns c
-                                     LEFT JOIN information_schema.key_column_usage k
-                                               ON c.table_name = k.table_name
-                                                   AND c.column_name = k.column_name
-                                     LEFT JOIN information_schema.table_constraints tc
-                                               ON k.constraint_name = tc.constraint_name
-                            WHERE c.table_schema = 'public'
-                            ORDER BY c.table_name, c.ordinal_position
-                            """)
-
-            rows = cur.fetchall()
+            fingerprint = None
+            rows = None
+
+            try:
+                fingerprint = self._schema_fingerprint(cur)
+            except Exception as e:
+                # without a fingerprint the catalog is read every time
+                log.error("Error: {}".format(e))
+
+            if self.metadata_cache and fingerprint is not None:
+                key = self._metadata_key()
+                rows = self.metadata_cache.load(key, fingerprint)
+
+            if rows is None:
+                rows = self._read_catalog(cur, dialect)
+
+                if self.metadata_cache and fingerprint is not None:
+                    try:
+                        self.metadata_cache.save(key, fingerprint, rows)
+                    except Exception as e:
+                        log.error("Error: {}".format(e))
+
+            # built aside and swapped in whole, requests never see a partial one
             self.meta = self._build_meta(rows)
+            self.fingerprint = fingerprint
+
+            # compiled plans and cached results refer to the previous schema
+            self.plan_cache.clear()
+            self.result_cache.clear()
+            return True
 
         except Exception as e:
             log.error("Error: {}".format(e))
+            broken = self.adapter.is_disconnect(e, conn)
+            return False
         finally:
-            if cur:
-                cur.close()
-            self.adapter.release(conn)
+            self._close_cursor(cur)
+            self.adapter.release(conn, broken)
+
+
+    def schema_fingerprint(self):
+
+        conn = self.adapter.acquire()
+        cur = None
+        broken = False
+
+        try:
+            cur = conn.cursor()
+            return self._schema_fingerprint(cur)
+
+        except Exception as e:
+            broken = self.adapter.is_disconnect(e, conn)
+            raise
+        finally:
+            self._close_cursor(cur)
+            self.adapter.release(conn, broken)
+
+
+    def _table_filter(self, column):
+        """SQL condition and parameters restricting `column` to self.tables"""
+
+        if not self.tables:
+            return "", []
+
+        placeholders = ", ".join(["%s"] * len(self.tables))
+        return f" AND {column} IN ({placeholders})", list(self.tables)
+
+
+    def _read_catalog(self, cur, dialect):
+
+        if dialect == "mssql":
+            where, params = self._table_filter("c.TABLE_NAME")
+            cur.execute(self.adapter.render(f"""
+                        SELECT c.TABLE_NAME,
+                               c.COLUMN_NAME,
+                               c.DATA_TYPE,
+                               c.IS_NULLABLE,
+                               CASE WHEN k.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_PK
+                        FROM INFORMATION_SCHEMA.COLUMNS c
+                                 LEFT JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE k
+                                           ON c.TABLE_NAME = k.TABLE_NAME
+                                               AND c.COLUMN_NAME = k.COLUMN_NAME
+                                               AND OBJECTPROPERTY(
+                                                           OBJECT_ID(k.CONSTRAINT_SCHEMA + '.' + k.CONSTRAINT_NAME),
+                                                           'IsPrimaryKey'
+                                                   ) = 1
+                        WHERE 1 = 1{where}
+                        ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+                        """), params)
+
+        elif dialect == "mysql":
+            where, params = self._table_filter("c.TABLE_NAME")
+            cur.execute(f"""
+                        SELECT c.TABLE_NAME,
+                               c.COLUMN_NAME,
+                               c.DATA_TYPE,
+                               c.IS_NULLABLE,
+                               CASE WHEN k.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_PK
+                        FROM INFORMATION_SCHEMA.COLUMNS c
+                                 LEFT JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE k
+                                           ON c.TABLE_SCHEMA = k.TABLE_SCHEMA
+                                               AND c.TABLE_NAME = k.TABLE_NAME
+                                               AND c.COLUMN_NAME = k.COLUMN_NAME
+                                               AND k.CONSTRAINT_NAME = 'PRIMARY'
+                        WHERE c.TABLE_SCHEMA = DATABASE(){where}
+                        ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+                        """, params)
+
+        elif dialect == "postgres":
+            # the table filter is applied inside each view; pushed through the
+            # joined information_schema views it makes the planner nest loops
+            cols_where, cols_params = self._table_filter("table_name")
+            pk_where, pk_params = self._table_filter("tc.table_name")
+            cur.execute(f"""
+                        WITH cols AS MATERIALIZED (
+                            SELECT table_name, column_name, data_type, is_nullable, ordinal_position
+                            FROM information_schema.columns
+                            WHERE table_schema = 'public'{cols_where}
+                        ),
+                        pk AS MATERIALIZED (
+                            SELECT k.table_name, k.column_name
+                            FROM information_schema.table_constraints tc
+                                     JOIN information_schema.key_column_usage k
+                                          ON k.constraint_schema = tc.constraint_schema
+                                              AND k.constraint_name = tc.constraint_name
+                                              AND k.table_name = tc.table_name
+                            WHERE tc.constraint_type = 'PRIMARY KEY'
+                              AND tc.table_schema = 'public'{pk_where}
+                        )
+                        SELECT c.table_name,
+                               c.column_name,
+                               c.data_type,
+                               c.is_nullable,
+                               CASE WHEN pk.column_name IS NOT NULL THEN 1 ELSE 0 END AS is_pk
+                        FROM cols c
+                                 LEFT JOIN pk
+                                           ON pk.table_name = c.table_name
+                                               AND pk.column_name = c.column_name
+                        ORDER BY c.table_name, c.ordinal_position
+                        """, cols_params + pk_params)
+
+        # DictCursor rows on MySQL
+        return [
+            tuple(row.values()) if isinstance(row, dict) else tuple(row)
+            for row in cur.fetchall()
+        ]
+
+
+    def _schema_fingerprint(self, cur):
+        """
+        Cheap digest of the column definitions and primary keys of the
+        tables, read from the system catalog without the INFORMATION_SCHEMA
+        joins. Any DDL on those tables changes it.
+        """
+
+        dialect = self.cfg["active_dialect"]
+
+        if dialect == "mssql":
+            where, params = self._table_filter("o.name")
+            cur.execute(self.adapter.render(f"""
+                        SELECT COUNT(*),
+                               CHECKSUM_AGG(CHECKSUM(o.name, c.name, c.column_id, c.system_type_id,
+                                                     c.max_length, c.is_nullable)),
+                               MAX(o.modify_date)
+                        FROM sys.columns c
+                                 JOIN sys.objects o ON o.object_id = c.object_id
+                        WHERE o.type IN ('U', 'V'){where}
+                        """), params)
+
+        elif dialect == "mysql":
+            where, params = self._table_filter("TABLE_NAME")
+            cur.execute(f"""
+                        SELECT COUNT(*),
+                               SUM(CRC32(CONCAT_WS(':', TABLE_NAME, ORDINAL_POSITION, COLUMN_NAME,
+                                                   COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY)))
+                        FROM INFORMATION_SCHEMA.COLUMNS
+                        WHERE TABLE_SCHEMA = DATABASE(){where}
+                        """, params)
+
+        elif dialect == "postgres":
+            where, params = self._table_filter("c.relname")
+            cur.execute(f"""
+                        SELECT COUNT(*),
+                               SUM(hashtext(concat_ws(':', c.relname, a.attnum, a.attname, a.atttypid,
+                                                      a.atttypmod, a.attnotnull, p.conkey::text)))
+                        FROM pg_class c
+                                 JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = 'public'
+                                 JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0
+                                                        AND NOT a.attisdropped
+                                 LEFT JOIN pg_constraint p ON p.conrelid = c.oid AND p.contype = 'p'
+                        WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f'){where}
+                        """, params)
+
+        row = cur.fetchone()
+        if isinstance(row, dict):
+            row = tuple(row.values())
+
+        return MetadataCache.key(*row)
+
+
+    def _metadata_key(self):
+
+        dialect = self.cfg["active_dialect"]
+        database = self.cfg.get(f"db_{dialect}", {})
+
+        return MetadataCache.key(
+            dialect,
+            database.get("host"),
+            database.get("port"),
+            database.get("database"),
+            self.tables
+        )
 
 
     def _build_meta(self, rows):
@@ -115,26 +333,61 @@ class DB:
             if table not in meta.tables:
                 meta.tables[table] = {"columns": {}}
 
+            # a column in several constraints comes once per constraint
+            previous = meta.tables[table]["columns"].get(column)
+
             meta.tables[table]["columns"][column] = {
                 "type": dtype,
                 "nullable": nullable in ("YES", "yes", True, 1),
-                "pk": bool(is_pk)
+                "pk": bool(is_pk) or bool(previous and previous["pk"])
             }
 
         return meta
 
 
-    def execute(self, sql, params=None):
+    def select_lane(self, endpoint, params=None):
+        """
+        Picks the execution lane of a request. An explicit `lane` in the
+        endpoint configuration wins; otherwise reads with a `$top` up to
+        `odata.heavy_top_threshold` go to the "light" lane and unbounded or
+        larger reads to the "heavy" one. Writes use the default lane.
+        """
+
+        odata = self.cfg["odata"]
+        lanes = odata.get("lanes") or {}
 
-        conn = self.adapter.acquire()
+        if endpoint.get("lane") in lanes:
+            return endpoint["lane"]
+
+        if params is None or "light" not in lanes or "heavy" not in lanes:
+            return None
+
+        try:
+            top = int(params["$top"]) if "$top" in params else None
+        except ValueError:
+            top = None
+
+        if top is not None and top <= odata.get("heavy_top_threshold", 100):
+            return "light"
+
+        return "heavy"
+
+
+    def execute(self, sql, params=None, lane=None):
+
+        conn = self.adapter.acquire(lane)
         cur = None
+        cached = False
+        broken = False
 
         try:
-            cur = conn.cursor()
-            cur.execute(sql, params or [])
+            cur, cached = self.adapter.run(conn, sql, params or [])
+            if cur.description is None:
+                return []
             return cur.fetchall()
         except Exception as e:
             log.error("Error: {}".format(e))
+            broken = self.adapter.is_disconnect(e, conn)
             self.analytics.capture_error(
                 e,
                 component="DB",
@@ -143,10 +396,73 @@ class DB:
                     "operation": "execute",
                 }
             )
+            raise RuntimeError(f"Error : {e}")
         finally:
+            if not cached:
+                self._close_cursor(cur)
+            self.adapter.release(conn, broken, lane)
+
+
+    def stream(self, sql, params=None, lane=None, batch_size=None):
+        """
+        Runs `sql` on a server-side cursor and yields lists of at most
+        `batch_size` rows (`odata.fetch_batch_size` by default). The pooled
+        connection is only taken when iteration starts and is given back when
+        the generator is exhausted or closed.
+        """
+
+        batch_size = batch_size or self.cfg["odata"].get("fetch_batch_size", 1000)
+
+        conn = self.adapter.acquire(lane)
+        cur = None
+        broken = False
+
+        try:
+            cur = self.adapter.open_stream(conn, batch_size)
+            cur.execute(sql, params or [])
+
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            broken = self.adapter.is_disconnect(e, conn)
+            self.analytics.capture_error(
+                e,
+                component="DB",
+                extra={
+                    "dialect": "stream",
+                    "operation": "stream",
+                }
+            )
+            raise RuntimeError(f"Error : {e}")
+        finally:
+            self._close_cursor(cur)
+            if not broken:
+                try:
+                    self.adapter.close_stream(conn)
+                except Exception as e:
+                    log.error("Error: {}".format(e))
+                    broken = self.adapter.is_disconnect(e, conn)
+            self.adapter.release(conn, broken, lane)
+
+
+    def _single_batch(self, sql, params, lane):
+        rows = self.execute(sql, params, lane)
+        if rows:
+            yield rows
+
+
+    def _close_cursor(self, cur):
+        # closing a cursor of a dead connection may raise as well
+        try:
             if cur:
                 cur.close()
-            self.adapter.release(conn)
+        except Exception as e:
+            log.error("Error: {}".format(e))
 
 
     def _debug_foreign_keys(self, engine):
@@ -225,146 +541,747 @@ class DB:
             raise RuntimeError(f"Error : {e}")
 
 
-    def query_odata(self, table_name, params):
+    def query_odata(self, table_name, params, lane=None, approximate_count=False):
+        """
+        Runs an OData read. $apply transformations (filter, compute,
+        groupby, aggregate) run in the database, the other options apply to
+        their rows. With $count=true (or $inlinecount=allpages)
+        result["count"] holds the number of rows matching $filter, see
+        `count_odata`.
+        """
 
         try:
-            table = self.get_table(table_name)
-            columns = table["columns"]
+            sql, sql_params, columns = self._compile_query(table_name, params)
 
-            # ----- SELECT -----
-            if "$select" in params:
-                requested = [c.strip() for c in params["$select"].split(",")]
-                valid = [c for c in requested if c in columns]
-                if not valid:
-                    raise RuntimeError("No valid columns in $select")
-                select_clause = ", ".join(valid)
-            else:
-                select_clause = ", ".join(columns.keys())
-
-            sql = f"SELECT {select_clause} FROM {table_name}"
-            sql_params = []
-
-            # ----- WHERE ($filter) -----
-            if "$filter" in params:
-                where_sql, where_params = self._parse_filter(params["$filter"], columns)
-                if where_sql:
-                    sql += f" WHERE {where_sql}"
-                    sql_params.extend(where_params)
-
-            # ----- ORDER BY -----
-            if "$orderby" in params:
-                order_parts = []
-                for part in params["$orderby"].split(","):
-                    part = part.strip()
-                    if " " in part:
-                        col, direction = part.split()
-                        direction = direction.upper()
-                    else:
-                        col, direction = part, "ASC"
+            count = None
+            if self.wants_count(params):
+                count = self.count_odata(table_name, params, lane, approximate_count)
 
-                    if col in columns and direction in ("ASC", "DESC"):
-                        order_parts.append(f"{col} {direction}")
+            rows = self.execute(sql, sql_params, lane)
+            return {
+                "columns": columns,
+                "rows": rows,
+                "count": count
+            }
+        except InvalidQuery:
+            raise
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            self.analytics.capture_error(
+                e,
+                component="DB",
+                extra={
+                    "dialect": "query_odata",
+                    "operation": "query_odata",
+                }
+            )
+            raise RuntimeError(f"Error : {e}")
 
-                if order_parts:
-                    sql += " ORDER BY " + ", ".join(order_parts)
 
-            # ----- LIMIT / OFFSET -----
-            dialect = self.cfg["active_dialect"]
+    @staticmethod
+    def wants_count(params):
+        return str(params.get("$count", "")).lower() == "true" or \
+            params.get("$inlinecount") == "allpages"
 
-            top = int(params.get("$top", 0)) if "$top" in params else None
-            skip = int(params.get("$skip", 0)) if "$skip" in params else None
 
-            if top is not None:
-                if dialect == "mssql":
-                    if "ORDER BY" not in sql.upper():
-                        sql += " ORDER BY (SELECT 1)"
-                    sql += f" OFFSET {skip or 0} ROWS FETCH NEXT {top} ROWS ONLY"
-                else:
-                    sql += f" LIMIT {top}"
-                    if skip:
-                        sql += f" OFFSET {skip}"
+    def count_odata(self, table_name, params, lane=None, approximate=False):
+        """
+        Number of rows of $apply matching $filter; $top, $skip and $orderby
+        do not apply. With `approximate`, a count of the whole table is taken
+        from the statistics of the catalog when it has them.
 
-            rows = self.execute(sql, sql_params)
-            return {
-                "columns": select_clause.split(", "),
-                "rows": rows
-            }
+        Counts are kept in the result cache for `odata.count_cache_ttl`
+        seconds (0 disables it) and dropped by writes to the table.
+        """
+
+        try:
+            ttl = self.cfg["odata"].get("count_cache_ttl", 10)
+            key = ("$count", table_name, params.get("$apply"), params.get("$filter"), approximate)
+
+            if ttl:
+                body = self.result_cache.get(key)
+                if body is not None:
+                    return int(body)
+
+                # taken before the query, a write from now on invalidates it
+                generation = self.result_cache.generation(table_name)
+
+            count = None
+            if approximate and not params.get("$filter") and not params.get("$apply"):
+                count = self._estimated_count(table_name, lane)
+
+            if count is None:
+                sql, sql_params = self._compile_count(table_name, params)
+                count = self.execute(sql, sql_params, lane)[0][0]
+
+            count = int(count)
+
+            if ttl:
+                self.result_cache.put(key, table_name, str(count).encode(), ttl, generation)
+
+            return count
+
+        except InvalidQuery:
+            raise
         except Exception as e:
             log.error("Error: {}".format(e))
             self.analytics.capture_error(
                 e,
                 component="DB",
                 extra={
-                    "dialect": "query_odata",
-                    "operation": "query_odata",
+                    "dialect": "count_odata",
+                    "operation": "count_odata",
                 }
             )
             raise RuntimeError(f"Error : {e}")
 
 
-    def _parse_filter(self, filter_str, columns):
+    def _estimated_count(self, table_name, lane=None):
+        """Row count of the table from the catalog statistics, None when unknown"""
+
+        dialect = self.cfg["active_dialect"]
+        self.get_table(table_name)
+
+        if dialect == "mssql":
+            sql = """
+                  SELECT SUM(rows)
+                  FROM sys.partitions
+                  WHERE object_id = OBJECT_ID(%s) AND index_id IN (0, 1)
+                  """
+        elif dialect == "mysql":
+            sql = """
+                  SELECT TABLE_ROWS
+                  FROM INFORMATION_SCHEMA.TABLES
+                  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                  """
+        else:
+            # -1 until the table is first analyzed
+            sql = """
+                  SELECT reltuples
+                  FROM pg_class
+                  WHERE oid = to_regclass(%s) AND relkind IN ('r', 'm')
+                  """
 
         try:
-            ops = {
-                "eq": "=",
-                "ne": "!=",
-                "gt": ">",
-                "lt": "<",
-                "ge": ">=",
-                "le": "<=",
-                "like": "LIKE"
-            }
+            rows = self.execute(self.adapter.render(sql), [table_name], lane)
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            return None
 
-            clauses = []
-            params = []
+        value = rows[0][0] if rows else None
+        if value is None or value < 0:
+            return None
 
-            parts = [p.strip() for p in filter_str.split(" and ")]
+        return int(value)
 
-            for p in parts:
-                tokens = p.split(" ", 2)
-                if len(tokens) != 3:
-                    continue
 
-                col, op, val = tokens
-                if col not in columns or op not in ops:
-                    continue
+    def stream_odata(self, table_name, params, lane=None, batch_size=None,
+                     keys=None, page_size=None, page_bytes=None, approximate_count=False):
+        """
+        Same query as `query_odata`, but the rows are returned as a generator
+        of batches (see `stream`). The SQL is compiled up front so invalid
+        options fail before the caller starts a response.
+
+        With `page_size` the read is paged by keyset: rows are ordered by
+        $orderby plus the key columns (`keys`, or the primary key of the
+        table), a $skiptoken seeks past the last row of the previous page, and
+        once the batches are consumed result["page"]["next"] holds the token
+        of the next page, or None on the last one.
+
+        With `page_bytes` the page is also bounded by size: its row count is
+        derived from the observed row size of the table, and the page is cut
+        early once the caller has added more than `page_bytes` to
+        result["page"]["sent_bytes"].
+
+        The rows of $apply and the rows of a table without a key have no key
+        to seek by: they are paged by offset instead, in the $orderby order
+        completed with their other columns, and the $skiptoken holds the
+        offset of the next page.
+
+        result["count"] is filled as in `query_odata`; it counts every row
+        matching $filter, not the rows of the page.
+        """
+
+        try:
+            page = None
+            seek = None
+
+            if page_size or page_bytes:
+                page_size = self.page_rows(table_name, page_size, page_bytes)
+                params = dict(params)
+
+                top = int(params["$top"]) if "$top" in params else None
+                limit = min(top, page_size) if top is not None else page_size
+
+                # the rows of $apply, and those of a table without a key,
+                # have no key to seek by: they are paged by offset
+                keys = None if "$apply" in params else self._page_keys(table_name, keys)
+                offset = None
+
+                if keys:
+                    sort = self._sort_spec(table_name, params.pop("$orderby", None), keys)
+
+                    values = None
+                    if params.get("$skiptoken"):
+                        values = self._seek_values(table_name, sort, params["$skiptoken"])
+                        params.pop("$skip", None)
 
-                # limpiar comillas
-                if (val.startswith("'") and val.endswith("'")) or \
-                        (val.startswith('"') and val.endswith('"')):
-                    val = val[1:-1]
+                    seek = (sort, values)
+                else:
+                    offset = int(params.get("$skip", 0))
+                    if params.get("$skiptoken"):
+                        offset = self._page_offset(params["$skiptoken"])
+
+                    params["$skip"] = str(offset)
+                    params["$orderby"] = self._total_order(table_name, params)
+
+                params.pop("$skiptoken", None)
+
+                # one extra row tells whether there is a next page
+                more = top is None or top > limit
+                params["$top"] = str(limit + 1 if more else limit)
+
+                page = {
+                    "size": limit,
+                    "next": None,
+                    "bytes": page_bytes,
+                    "sent_bytes": 0,
+                    # small steps keep the overshoot of the byte budget small
+                    "step": max(1, limit // 8) if page_bytes else None,
+                    # first row of the page of an offset-paged read
+                    "offset": offset
+                }
+
+            sql, sql_params, columns = self._compile_query(table_name, params, seek)
+
+            count = None
+            if self.wants_count(params):
+                count = self.count_odata(table_name, params, lane, approximate_count)
+
+            batch_size = batch_size or self.cfg["odata"].get("fetch_batch_size", 1000)
+            top = int(params["$top"]) if "$top" in params else None
+
+            if top is not None and top <= batch_size:
+                # fits in one batch, a plain (prepared) execution is cheaper
+                # than opening a server-side cursor
+                batches = self._single_batch(sql, sql_params, lane)
+            else:
+                batches = self.stream(sql, sql_params, lane, batch_size)
 
-                clauses.append(f"{col} {ops[op]} %s")
-                params.append(val)
+            if page is not None:
+                positions = None
+                if seek is not None:
+                    row_columns = columns + [c for c, _ in seek[0] if c not in columns]
+                    positions = [row_columns.index(c) for c, _ in seek[0]]
+                batches = self._paged(table_name, batches, page, positions)
 
-            return (" AND ".join(clauses), params) if clauses else (None, None)
+            return {
+                "columns": columns,
+                "batches": batches,
+                "page": page,
+                "count": count
+            }
+        except InvalidQuery:
+            # a bad option from the client, not a failure of the server
+            raise
         except Exception as e:
             log.error("Error: {}".format(e))
             self.analytics.capture_error(
                 e,
                 component="DB",
                 extra={
-                    "dialect": "_parse_filter",
-                    "operation": "_parse_filter",
+                    "dialect": "stream_odata",
+                    "operation": "stream_odata",
                 }
             )
             raise RuntimeError(f"Error : {e}")
 
-    def insert_odata(self, table_name, data: dict):
+
+    def _seek_values(self, table_name, sort, token):
+        """
+        Values of a $skiptoken converted to the types of the sort columns,
+        InvalidSkiptoken when the token does not hold values of that sort
+        """
+
+        values = decode_skiptoken(token, len(sort))
+        columns = self.get_table(table_name)["columns"]
+
         try:
-            table = self.get_table(table_name)
-            columns = table["columns"]
+            for i, (col, _) in enumerate(sort):
+                if values[i] is None:
+                    continue
+                # the text of the value, as any literal, parsed for the column
+                convert = literal_converter(col, columns[col]["type"])
+                values[i] = str(values[i]) if convert is None else convert(str(values[i]))
+        except Exception:
+            raise InvalidSkiptoken("Invalid $skiptoken")
+
+        return values
+
+
+    def _page_keys(self, table_name, keys=None):
+        """
+        Key columns a paged read seeks by: the `keys` of the endpoint found
+        in the table, or its primary key; empty when it has neither.
+        """
+
+        columns = self.get_table(table_name)["columns"]
+        keys = [k for k in keys or [] if k in columns]
+        return keys or [c for c, info in columns.items() if info["pk"]]
+
+
+    def _total_order(self, table_name, params):
+        """
+        $orderby of an offset-paged read: the requested sort followed by the
+        other sortable columns of its rows, so the pages follow one order
+        """
+
+        dialect = self.cfg["active_dialect"]
+        columns = self.get_table(table_name)["columns"]
+
+        if "$apply" in params:
+            steps, _ = parse_apply(params["$apply"])
+            columns = compile_apply(steps, table_name, columns, dialect)[3]
+
+        if "$select" in params:
+            selected = [c.strip() for c in params["$select"].split(",")]
+            columns = {c: columns[c] for c in selected if c in columns} or columns
+
+        parts = [p.strip() for p in (params.get("$orderby") or "").split(",") if p.strip()]
+        named = {p.split()[0] for p in parts}
+        unsortable = UNSORTABLE_TYPES.get(dialect, set())
+
+        parts += [
+            c for c, info in columns.items()
+            if c not in named and (info.get("type") or "").lower() not in unsortable
+        ]
+        return ",".join(parts)
+
+
+    def _page_offset(self, token):
+        """Row offset held by the $skiptoken of an offset-paged read"""
+
+        offset = decode_skiptoken(token, 1)[0]
+        if type(offset) is not int or offset < 0:
+            raise InvalidSkiptoken("Invalid $skiptoken")
+        return offset
+
+
+    def _paged(self, table_name, batches, page, positions):
+        """
+        Passes through at most page["size"] rows, or fewer once the byte
+        budget is spent, and when rows are left stores the $skiptoken of the
+        next page in page["next"]: the sort values at `positions` of the last
+        row sent, or the offset of the next row when `positions` is None.
+        """
+
+        def token(row, sent):
+            if positions is None:
+                return encode_skiptoken([page["offset"] + sent])
+            return encode_skiptoken([row[i] for i in positions])
+
+        sent = 0
+        last = None
+
+        try:
+            for batch in batches:
+                step = page["step"] or len(batch)
+
+                for start in range(0, len(batch), step):
+                    if sent >= page["size"] or (
+                        page["bytes"] and page["sent_bytes"] >= page["bytes"]
+                    ):
+                        page["next"] = token(last, sent)
+                        return
+
+                    rows = batch[start:start + step]
+                    room = page["size"] - sent
+
+                    if len(rows) > room:
+                        yield rows[:room]
+                        sent = page["size"]
+                        page["next"] = token(rows[room - 1], sent)
+                        return
+
+                    sent += len(rows)
+                    last = rows[-1]
+                    yield rows
+        finally:
+            if sent and page["sent_bytes"]:
+                self._observe_rows(table_name, page["sent_bytes"], sent)
+            batches.close()
+
+
+    def page_rows(self, table_name, max_rows=None, max_bytes=None):
+        """
+        Row count of a server-driven page: `max_rows` (or
+        `odata.default_page_rows`), lowered so that `max_bytes` fits the
+        average row size observed for the table.
+        """
+
+        rows = max_rows or self.cfg["odata"].get("default_page_rows", 1000)
+
+        avg = self.row_bytes.get(table_name)
+        if max_bytes and avg:
+            rows = min(rows, max(1, int(max_bytes // avg)))
+
+        return rows
+
 
-            valid = {k: v for k, v in data.items() if k in columns}
+    def _observe_rows(self, table_name, size, rows):
+
+        with self.row_bytes_lock:
+            avg = self.row_bytes.get(table_name)
+            sample = size / rows
+            self.row_bytes[table_name] = sample if avg is None else 0.8 * avg + 0.2 * sample
+
+
+    def _sort_spec(self, table_name, orderby, keys=None):
+        """
+        Sort of a paged read: the valid $orderby columns followed by the key
+        columns, so the order is total and a page can seek past its last row.
+        """
+
+        columns = self.get_table(table_name)["columns"]
+        sort = []
+
+        for part in (orderby or "").split(","):
+            part = part.strip()
+            if not part:
+                continue
+            col, _, direction = part.partition(" ")
+            direction = direction.strip().upper() or "ASC"
+            if col in columns and direction in ("ASC", "DESC"):
+                sort.append((col, direction))
+
+        keys = keys or [c for c, info in columns.items() if info["pk"]]
+        if not keys:
+            raise RuntimeError(f"Table '{table_name}' has no key to page by")
+
+        for key in keys:
+            if key not in columns:
+                raise RuntimeError(f"Key column '{key}' not found")
+            if key not in [c for c, _ in sort]:
+                sort.append((key, "ASC"))
+
+        return tuple(sort)
+
+
+    def _compile_query(self, table_name, params, seek=None):
+        """
+        Returns the SQL, its parameters and the column names for an OData
+        read. The SQL text only depends on the shape of the options, so it is
+        built once per shape and kept in the plan cache; the literals of each
+        request are converted to the types of their columns and bound as
+        parameters.
+        """
+
+        key, literals = self._query_shape(table_name, params, seek)
+
+        # a plan built from metadata replaced meanwhile is not stored
+        epoch = self.plan_cache.epoch
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            plan = self._build_plan(table_name, key)
+            self.plan_cache.put(key, plan, epoch)
+
+        sql, slots, converters, columns = plan
+        values = self._bind(literals, slots, converters)
+        return sql, values, columns
+
+
+    def _compile_count(self, table_name, params):
+        """
+        SQL and parameters counting the rows of an OData read. Only $apply
+        and $filter apply, they are compiled as for the read itself.
+        """
+
+        apply_shape, literals = self._apply_shape(params)
+        filter_shape, filter_literals = self._filter_shape(params)
+        literals.extend(filter_literals)
+        key = (table_name, "$count", apply_shape, filter_shape)
+
+        epoch = self.plan_cache.epoch
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            plan = self._build_count_plan(table_name, apply_shape, filter_shape)
+            self.plan_cache.put(key, plan, epoch)
+
+        sql, slots, converters = plan
+        return sql, self._bind(literals, slots, converters)
+
+
+    def _bind(self, literals, slots, converters):
+        return [
+            literals[i] if convert is None else convert(literals[i])
+            for i, convert in zip(slots, converters)
+        ]
+
+
+    def _filter_shape(self, params):
+        """The tree of the $filter and its number of literals, and the literals"""
+
+        if "$filter" not in params:
+            return None, []
+
+        tree, literals = parse_filter(params["$filter"])
+        return (tree, len(literals)), literals
+
+
+    def _apply_shape(self, params):
+        """The transformations of the $apply and their number of literals, and the literals"""
+
+        if "$apply" not in params:
+            return None, []
+
+        steps, literals = parse_apply(params["$apply"])
+        return (steps, len(literals)), literals
+
+
+    def _query_shape(self, table_name, params, seek=None):
+
+        select = None
+        if "$select" in params:
+            select = tuple(c.strip() for c in params["$select"].split(","))
+
+        # $filter applies to the rows of $apply, its literals come after
+        apply_shape, literals = self._apply_shape(params)
+        filter_shape, filter_literals = self._filter_shape(params)
+        literals.extend(filter_literals)
+
+        orderby = None
+        if "$orderby" in params:
+            orderby = tuple(part.strip() for part in params["$orderby"].split(","))
+
+        # keyset: the sort of a paged read and the values to seek past
+        seek_key = None
+        if seek is not None:
+            sort, values = seek
+            # a NULL seek value is compared with IS NULL, not bound, so
+            # which values are NULL is part of the shape
+            seek_key = (sort, None if values is None else tuple(v is None for v in values))
+            if values is not None:
+                literals.extend(values)
+
+        top = int(params.get("$top", 0)) if "$top" in params else None
+        skip = int(params.get("$skip", 0)) if "$skip" in params else None
+
+        if top is not None:
+            literals.append(skip or 0)
+            literals.append(top)
+
+        key = (table_name, apply_shape, select, filter_shape, orderby, seek_key,
+               top is not None, bool(skip))
+        return key, literals
+
+
+    def _build_plan(self, table_name, key):
+
+        _, apply_shape, select, filter_shape, orderby, seek_key, has_top, has_skip = key
+
+        table = self.get_table(table_name)
+        columns = table["columns"]
+        dialect = self.cfg["active_dialect"]
+
+        slots = []
+        converters = []
+
+        # ----- FROM ($apply) -----
+        # the rest of the options apply to the rows of the transformations,
+        # which have their own columns
+        source = table_name
+        apply_count = 0
+        if apply_shape:
+            steps, apply_count = apply_shape
+            apply_sql, slots, converters, columns = compile_apply(steps, table_name, columns, dialect)
+            source = f"({apply_sql}) AS a"
+
+        # ----- SELECT -----
+        if select is not None:
+            valid = [c for c in select if c in columns]
             if not valid:
-                raise RuntimeError("No valid columns to insert")
+                raise InvalidQuery("No valid columns in $select")
+        else:
+            valid = list(columns.keys())
+
+        # a paged read needs the sort values of its last row, columns missing
+        # from $select are fetched after the selected ones
+        fetched = valid
+        if seek_key is not None:
+            fetched = valid + [c for c, _ in seek_key[0] if c not in valid]
+
+        sql = f"SELECT {', '.join(fetched)} FROM {source}"
+        where = []
+
+        # the converters turn the literal of each slot into the type of its
+        # column, so the database compares typed values instead of casting
+        # strings
+
+        # ----- WHERE ($filter) -----
+        filter_count = 0
+        if filter_shape:
+            tree, filter_count = filter_shape
+            where_sql, where_slots, where_converters = compile_filter(tree, columns, dialect)
+            where.append(f"({where_sql})")
+            slots.extend(i + apply_count for i in where_slots)
+            converters.extend(where_converters)
+
+        # ----- WHERE (keyset) -----
+        first_slot = apply_count + filter_count
+        if seek_key is not None and seek_key[1] is not None:
+            nullable = {c for c, _ in seek_key[0] if columns[c].get("nullable")}
+            seek_sql, seek_slots = self._keyset_clause(
+                seek_key[0], first_slot, dialect, nullable, seek_key[1]
+            )
+            where.append(f"({seek_sql})")
+            slots.extend(seek_slots)
+            seek_converters = [literal_converter(c, columns[c]["type"]) for c, _ in seek_key[0]]
+            converters.extend(seek_converters[i - first_slot] for i in seek_slots)
+
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+
+        # ----- ORDER BY -----
+        if orderby:
+            order_parts = []
+            for part in orderby:
+                if " " in part:
+                    col, direction = part.split()
+                    direction = direction.upper()
+                else:
+                    col, direction = part, "ASC"
+
+                if col in columns and direction in ("ASC", "DESC"):
+                    order_parts.append(f"{col} {direction}")
 
-            cols = ", ".join(valid.keys())
-            placeholders = ", ".join(["%s"] * len(valid))
+            if order_parts:
+                sql += " ORDER BY " + ", ".join(order_parts)
 
-            sql = f"INSERT INTO {table_name} ({cols}) VALUES ({placeholders})"
+        if seek_key is not None:
+            sql += " ORDER BY " + ", ".join(f"{c} {d}" for c, d in seek_key[0])
 
-            self.execute(sql, list(valid.values()))
+        # ----- LIMIT / OFFSET -----
+        # skip and top are the last two literals of the shape
+        skip_slot = first_slot
+        if seek_key is not None and seek_key[1] is not None:
+            skip_slot += len(seek_key[0])
+        top_slot = skip_slot + 1
+
+        if has_top:
+            if dialect == "mssql":
+                if "ORDER BY" not in sql.upper():
+                    sql += " ORDER BY (SELECT 1)"
+                sql += " OFFSET %s ROWS FETCH NEXT %s ROWS ONLY"
+                slots.extend([skip_slot, top_slot])
+                converters.extend([None, None])
+            else:
+                sql += " LIMIT %s"
+                slots.append(top_slot)
+                converters.append(None)
+                if has_skip:
+                    sql += " OFFSET %s"
+                    slots.append(skip_slot)
+                    converters.append(None)
+
+        return self.adapter.render(sql), slots, converters, valid
+
+
+    def _build_count_plan(self, table_name, apply_shape, filter_shape):
+
+        columns = self.get_table(table_name)["columns"]
+        dialect = self.cfg["active_dialect"]
+        sql = f"SELECT COUNT(*) FROM {table_name}"
+        slots, converters = [], []
+
+        apply_count = 0
+        if apply_shape:
+            steps, apply_count = apply_shape
+            apply_sql, slots, converters, columns = compile_apply(steps, table_name, columns, dialect)
+            sql = f"SELECT COUNT(*) FROM ({apply_sql}) AS a"
+
+        if filter_shape:
+            tree, _ = filter_shape
+            where_sql, where_slots, where_converters = compile_filter(tree, columns, dialect)
+            sql += f" WHERE {where_sql}"
+            slots.extend(i + apply_count for i in where_slots)
+            converters.extend(where_converters)
+
+        return self.adapter.render(sql), slots, converters
+
+
+    def _keyset_clause(self, sort, first_slot, dialect, nullable=(), nulls=None):
+        """
+        Predicate selecting the rows after the seek values, in sort order.
+        Uniform directions over columns without NULLs use a row value
+        comparison where the dialect has one, otherwise the comparison is
+        expanded column by column.
+
+        `nullable` holds the sort columns that may be NULL and `nulls` tells
+        which seek values are NULL. Postgres sorts NULLs last in ascending
+        order, SQL Server and MySQL sort them first; the expanded terms
+        follow the order of the dialect so that no row is skipped.
+        """
+
+        cols = [c for c, _ in sort]
+        directions = {d for _, d in sort}
+        slots = list(range(first_slot, first_slot + len(sort)))
+        nulls = nulls or (False,) * len(sort)
+
+        if len(directions) == 1 and dialect != "mssql" and not nullable:
+            op = ">" if "ASC" in directions else "<"
+            placeholders = ", ".join(["%s"] * len(cols))
+            return f"({', '.join(cols)}) {op} ({placeholders})", slots
+
+        terms = []
+        term_slots = []
+
+        for i, (col, direction) in enumerate(sort):
+            op = ">" if direction == "ASC" else "<"
+            nulls_last = (direction == "ASC") == (dialect == "postgres")
+
+            parts = []
+            part_slots = []
+            for j in range(i):
+                if nulls[j]:
+                    parts.append(f"{cols[j]} IS NULL")
+                else:
+                    parts.append(f"{cols[j]} = %s")
+                    part_slots.append(slots[j])
+
+            if nulls[i]:
+                # nothing sorts after a NULL placed last
+                if nulls_last:
+                    continue
+                parts.append(f"{col} IS NOT NULL")
+            elif col in nullable and nulls_last:
+                parts.append(f"({col} {op} %s OR {col} IS NULL)")
+                part_slots.append(slots[i])
+            else:
+                parts.append(f"{col} {op} %s")
+                part_slots.append(slots[i])
+
+            terms.append("(" + " AND ".join(parts) + ")")
+            term_slots.extend(part_slots)
+
+        return " OR ".join(terms) or "1 = 0", term_slots
+
+
+    def insert_odata(self, table_name, data: dict, lane=None, coalesce=False):
+        """
+        Inserts one row. With `coalesce` the row waits a few milliseconds for
+        concurrent inserts of the same table and columns and goes to the
+        database with them as one multi-row INSERT.
+        """
+
+        try:
+            if coalesce:
+                columns, values = self._insert_row(table_name, data)
+                self.write_coalescer.submit((table_name, columns, lane), values)
+            else:
+                sql, params = self._insert_statement(table_name, data)
+                self.execute(sql, params, lane)
+
+            self.result_cache.invalidate(table_name)
             return {"status": "ok"}
 
         except Exception as e:
@@ -380,34 +1297,196 @@ class DB:
             raise RuntimeError(f"Error : {e}")
 
 
-    def update_odata(self, table_name, key_column: str, key_value, data: dict):
+    def _insert_row(self, table_name, data):
+
+        table = self.get_table(table_name)
+        columns = table["columns"]
+
+        if not isinstance(data, dict):
+            raise RuntimeError("Every row must be a JSON object")
+
+        valid = {k: v for k, v in data.items() if k in columns}
+        if not valid:
+            raise RuntimeError("No valid columns to insert")
+
+        return tuple(valid.keys()), list(valid.values())
+
+
+    def _insert_statement(self, table_name, data):
+
+        columns, values = self._insert_row(table_name, data)
+        return self._insert_sql(table_name, columns), values
+
+
+    def _insert_sql(self, table_name, columns, rows=1):
+
+        row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        return self.adapter.render(
+            f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES {', '.join([row] * rows)}"
+        )
+
+
+    def _flush_inserts(self, key, rows):
+        """
+        Writes the rows gathered by the write coalescer with multi-row
+        INSERTs. A failing statement is retried row by row so every caller
+        gets the outcome of its own row.
+        """
+
+        table_name, columns, lane = key
+        size = max(1, self.adapter.max_params // len(columns))
+        results = []
+
+        for i in range(0, len(rows), size):
+            chunk = rows[i:i + size]
+            try:
+                sql = self._insert_sql(table_name, columns, len(chunk))
+                self.execute(sql, [v for row in chunk for v in row], lane)
+                results.extend([None] * len(chunk))
+            except Exception as e:
+                if len(chunk) == 1:
+                    results.append(e)
+                    continue
+
+                sql = self._insert_sql(table_name, columns)
+                for row in chunk:
+                    try:
+                        self.execute(sql, row, lane)
+                        results.append(None)
+                    except Exception as row_error:
+                        results.append(row_error)
+
+        return results
+
+
+    def bulk_insert_odata(self, table_name, rows: list, lane=None):
+        """
+        Inserts many rows in one transaction through the fastest path of the
+        dialect (COPY, multi-row INSERT or fast_executemany). Rows are grouped
+        by their set of columns, so a column left out of a row keeps its
+        default instead of being set to NULL.
+        """
+
+        conn = None
+        broken = False
+
         try:
             table = self.get_table(table_name)
             columns = table["columns"]
 
-            if key_column not in columns:
-                raise RuntimeError(f"Key column '{key_column}' not found")
+            groups = {}
+            for row in rows:
+                if not isinstance(row, dict):
+                    raise RuntimeError("Every row must be a JSON object")
+
+                cols = tuple(c for c in columns if c in row)
+                if not cols:
+                    raise RuntimeError("No valid columns to insert")
+
+                groups.setdefault(cols, []).append(tuple(row[c] for c in cols))
 
-            updates = []
-            params = []
+            chunk_size = self.cfg["odata"].get("bulk_chunk_size", 1000)
 
-            for k, v in data.items():
-                if k in columns and k != key_column:
-                    updates.append(f"{k} = %s")
-                    params.append(v)
+            conn = self.adapter.acquire(lane)
+            count = self.adapter.bulk_insert(conn, table_name, list(groups.items()), chunk_size)
 
-            if not updates:
-                raise RuntimeError("No valid columns to update")
+            self.result_cache.invalidate(table_name)
+            return {"status": "ok", "inserted": count}
 
-            sql = (
-                f"UPDATE {table_name} "
-                f"SET {', '.join(updates)} "
-                f"WHERE {key_column} = %s"
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            if conn:
+                broken = self.adapter.is_disconnect(e, conn)
+            self.analytics.capture_error(
+                e,
+                component="DB",
+                extra={
+                    "dialect": "bulk_insert_odata",
+                    "operation": "bulk_insert_odata",
+                }
             )
+            raise RuntimeError(f"Error : {e}")
+        finally:
+            if conn:
+                self.adapter.release(conn, broken, lane)
+
+
+    def upsert_odata(self, table_name, rows: list, keys=None, lane=None):
+        """
+        Inserts the rows that do not exist yet and updates the ones that do,
+        matching on `keys` (the primary key of the table by default). Runs
+        in chunks of `odata.bulk_chunk_size` rows on one connection and in
+        one transaction. When a key repeats, its last row wins.
+        """
+
+        conn = None
+        broken = False
+
+        try:
+            keys, groups = self._upsert_groups(table_name, rows, keys)
+            chunk_size = self.cfg["odata"].get("bulk_chunk_size", 1000)
+
+            conn = self.adapter.acquire(lane)
+            count = self.adapter.bulk_upsert(conn, table_name, keys, groups, chunk_size)
+
+            self.result_cache.invalidate(table_name)
+            return {"status": "ok", "upserted": count}
+
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            if conn:
+                broken = self.adapter.is_disconnect(e, conn)
+            self.analytics.capture_error(
+                e,
+                component="DB",
+                extra={
+                    "dialect": "upsert_odata",
+                    "operation": "upsert_odata",
+                }
+            )
+            raise RuntimeError(f"Error : {e}")
+        finally:
+            if conn:
+                self.adapter.release(conn, broken, lane)
+
+
+    def _upsert_groups(self, table_name, rows, keys=None):
+        """
+        Key columns of an upsert and its rows grouped by column set, as
+        (columns, rows) pairs with the last row of each key.
+        """
+
+        table = self.get_table(table_name)
+        columns = table["columns"]
+
+        keys = keys or [c for c, info in columns.items() if info["pk"]]
+        if not keys:
+            raise RuntimeError(f"Table '{table_name}' has no key to upsert by")
+
+        for key in keys:
+            if key not in columns:
+                raise RuntimeError(f"Key column '{key}' not found")
+
+        groups = {}
+        for row in rows:
+            if not isinstance(row, dict):
+                raise RuntimeError("Every row must be a JSON object")
+            if any(k not in row for k in keys):
+                raise RuntimeError(f"Every row needs the key columns {', '.join(keys)}")
 
-            params.append(key_value)
+            cols = tuple(c for c in columns if c in row)
+            group = groups.setdefault(cols, {})
+            group[tuple(row[k] for k in keys)] = tuple(row[c] for c in cols)
 
-            self.execute(sql, params)
+        return keys, [(cols, list(group.values())) for cols, group in groups.items()]
+
+
+    def update_odata(self, table_name, key_column: str, key_value, data: dict, lane=None):
+        try:
+            sql, params = self._update_statement(table_name, key_column, key_value, data)
+
+            self.execute(sql, params, lane)
+            self.result_cache.invalidate(table_name)
             return {"status": "ok"}
 
         except Exception as e:
@@ -423,9 +1502,146 @@ class DB:
             raise RuntimeError(f"Error : {e}")
 
 
+    def _update_statement(self, table_name, key_column, key_value, data):
+
+        table = self.get_table(table_name)
+        columns = table["columns"]
+
+        if key_column not in columns:
+            raise RuntimeError(f"Key column '{key_column}' not found")
+
+        updates = []
+        params = []
+
+        for k, v in data.items():
+            if k in columns and k != key_column:
+                updates.append(f"{k} = %s")
+                params.append(v)
+
+        if not updates:
+            raise RuntimeError("No valid columns to update")
+
+        sql = self.adapter.render(
+            f"UPDATE {table_name} "
+            f"SET {', '.join(updates)} "
+            f"WHERE {key_column} = %s"
+        )
+
+        params.append(key_value)
+        return sql, params
+
+
+    def change_set(self, operations, lane=None):
+        """
+        Runs write operations atomically on one connection: all of them are
+        committed or none is. Each operation is a dict with "kind" and
+        "table" plus the arguments of the matching single call:
+
+            insert  "rows"
+            update  "key_column", "key_value", "data"
+            upsert  "rows", "keys"
+
+        Returns one result per operation.
+        """
+
+        conn = None
+        broken = False
+
+        try:
+            statements = [self._change_statements(op) for op in operations]
+            chunk_size = self.cfg["odata"].get("bulk_chunk_size", 1000)
+            results = []
+
+            conn = self.adapter.acquire(lane)
+
+            with self.adapter.transaction(conn):
+                cur = conn.cursor()
+                try:
+                    for op, statement in zip(operations, statements):
+                        if op["kind"] == "upsert":
+                            keys, groups = statement
+                            count = self.adapter.upsert_rows(cur, op["table"], keys, groups, chunk_size)
+                            results.append({"status": "ok", "upserted": count})
+                        else:
+                            for sql, params in statement:
+                                cur.execute(sql, params)
+                            results.append({"status": "ok"})
+                finally:
+                    self._close_cursor(cur)
+
+            for table_name in {op["table"] for op in operations}:
+                self.result_cache.invalidate(table_name)
+
+            return results
+
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            if conn:
+                broken = self.adapter.is_disconnect(e, conn)
+            self.analytics.capture_error(
+                e,
+                component="DB",
+                extra={
+                    "dialect": "change_set",
+                    "operation": "change_set",
+                }
+            )
+            raise RuntimeError(f"Error : {e}")
+        finally:
+            if conn:
+                self.adapter.release(conn, broken, lane)
+
+
+    def _change_statements(self, op):
+        # everything is validated before the connection is taken
+
+        if op["kind"] == "insert":
+            return [self._insert_statement(op["table"], row) for row in op["rows"]]
+
+        if op["kind"] == "update":
+            return [self._update_statement(
+                op["table"], op["key_column"], op["key_value"], op["data"]
+            )]
+
+        if op["kind"] == "upsert":
+            return self._upsert_groups(op["table"], op["rows"], op.get("keys"))
+
+        raise RuntimeError(f"Unknown operation '{op['kind']}'")
+
+
+    def etag(self, table_name, key, ttl=None):
+        """
+        ETag of a read of `table_name` with the normalized query `key`. It
+        changes with every write through `insert_odata`/`update_odata`, a
+        metadata reload and a restart. Writes made to the database directly
+        or through another instance are not seen, so the ETag also changes
+        every `ttl` seconds (`odata.etag_ttl` by default): a client
+        revalidating keeps stale data for at most that long.
+        """
+
+        ttl = ttl or self.cfg["odata"].get("etag_ttl", 60)
+        bucket = int(time.time() // ttl)
+
+        version = self.result_cache.generation(table_name)
+        return hashlib.sha1(repr((self.instance, version, bucket, key)).encode()).hexdigest()
+
+
+    def stats(self):
+        return {
+            "plan_cache": self.plan_cache.stats(),
+            "result_cache": self.result_cache.stats(),
+            "coalescing": self.flights.stats(),
+            "write_coalescing": self.write_coalescer.stats(),
+            "row_bytes": {t: round(b, 1) for t, b in self.row_bytes.items()},
+            "schema_watcher": self.schema_watcher.stats(),
+            "pools": self.adapter.status()
+        }
+
+
     def test_connection(self):
         conn = None
         cur = None
+        broken = False
         try:
             conn = self.adapter.acquire()
             cur = conn.cursor()
@@ -434,6 +1650,8 @@ class DB:
             return {"ok": True}
         except Exception as e:
             log.error("Error: {}".format(e))
+            if conn:
+                broken = self.adapter.is_disconnect(e, conn)
             self.analytics.capture_error(
                 e,
                 component="DB",
@@ -444,7 +1662,6 @@ class DB:
             )
             return {"ok": False, "error": str(e)}
         finally:
-            if cur:
-                cur.close()
+            self._close_cursor(cur)
             if conn:
-                self.adapter.release(conn)
+                self.adapter.release(conn, broken)
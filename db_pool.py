@@ -1,32 +1,441 @@
 import pyodbc
 import pymysql
 import psycopg2
-from queue import Queue, Empty
+import io
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from analytics.logger import setup_logger
 
 log = setup_logger()
 
 
 class ConnectionPool:
+    """
+    Elastic pool of DB-API connections.
+
+    Keeps up to `size` connections open and bursts up to `size + max_overflow`
+    under load; overflow connections are closed when they are returned while
+    the pool already holds `size` idle ones. Connections older than `recycle`
+    seconds are replaced on checkout, and with `pre_ping` every checkout is
+    validated first.
+
+    Only `min_size` connections are opened up front, with up to
+    `warmup_workers` handshakes in parallel. The rest are opened on demand:
+    when a checkout takes the last idle connection a replacement is opened in
+    the background, so the next request does not pay for the handshake.
+
+    Connections released as `broken`, or found closed on checkout, are
+    evicted instead of being handed out again, and replaced in the background.
+    """
+
+    def __init__(self, factory, size=10, max_overflow=0, timeout=5,
+                 recycle=-1, pre_ping=False, ping=None,
+                 min_size=None, warmup_workers=4, is_closed=None, on_close=None):
+        self.factory = factory
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.ping = ping or _ping
+        self.is_closed = is_closed or (lambda conn: False)
+        self.on_close = on_close
+        self.evictions = 0
+
+        self.lock = threading.Condition()
+        self.idle = deque()
+        self.born = {}
+        self.opened = 0
+        self.warmup_workers = max(1, warmup_workers)
+
+        min_size = size if min_size is None else min(min_size, size)
+
+        self.opened = min_size
+        errors = self._warm_up(min_size)
+
+        if min_size and len(errors) == min_size:
+            raise errors[0]
+
+    def acquire(self, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        conn = None
+
+        with self.lock:
+            while True:
+                if self.idle:
+                    conn = self.idle.pop()
+
+                    if not self.idle and self.opened < self.size:
+                        self.opened += 1
+                        self._replace()
+                    break
+
+                if self.opened < self.size + self.max_overflow:
+                    self.opened += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    log.error("Timeout while acquiring connection")
+                    raise Exception("DB connection pool exhausted")
+
+                self.lock.wait(remaining)
+
+        try:
+            if conn is None:
+                return self._open()
+            return self._checkout(conn)
+        except Exception:
+            with self.lock:
+                self.opened -= 1
+                self.lock.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        with self.lock:
+            if broken:
+                self.evictions += 1
+                self._close(conn)
+                if self.opened > self.size:
+                    self.opened -= 1
+                else:
+                    # keep the slot reserved for the replacement
+                    self._replace()
+            elif len(self.idle) >= self.size:
+                # overflow connection, let the pool shrink back to its size
+                self.opened -= 1
+                self._close(conn)
+            else:
+                self.idle.append(conn)
+            self.lock.notify()
+
+    def status(self):
+        with self.lock:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "opened": self.opened,
+                "idle": len(self.idle),
+                "in_use": self.opened - len(self.idle),
+                "evictions": self.evictions
+            }
+
+    def _replace(self):
+        threading.Thread(
+            target=self._warm_up,
+            args=(1,),
+            daemon=True
+        ).start()
+
+    def _warm_up(self, count):
+        """
+        Opens `count` connections, whose slots are already reserved in
+        `opened`, using up to `warmup_workers` parallel threads. Failed slots
+        are given back and the errors returned.
+        """
+
+        pending = [count]
+        errors = []
+
+        def worker():
+            while True:
+                with self.lock:
+                    if not pending[0]:
+                        return
+                    pending[0] -= 1
+
+                try:
+                    conn = self._open()
+                except Exception as e:
+                    log.error("Error opening pooled connection: {}".format(e))
+                    errors.append(e)
+                    with self.lock:
+                        self.opened -= 1
+                        self.lock.notify()
+                    continue
+
+                with self.lock:
+                    self.idle.append(conn)
+                    self.lock.notify()
+
+        threads = [
+            threading.Thread(target=worker, daemon=True)
+            for _ in range(min(self.warmup_workers, count))
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        return errors
+
+    def _checkout(self, conn):
+        if self.is_closed(conn):
+            with self.lock:
+                self.evictions += 1
+            self._close(conn)
+            return self._open()
+
+        if self.recycle is not None and self.recycle >= 0:
+            if time.monotonic() - self.born.get(id(conn), 0) > self.recycle:
+                self._close(conn)
+                return self._open()
+
+        if self.pre_ping:
+            try:
+                self.ping(conn)
+            except Exception as e:
+                log.error("Discarding connection that failed pre-ping: {}".format(e))
+                self._close(conn)
+                return self._open()
+
+        return conn
+
+    def _open(self):
+        conn = self.factory()
+        self.born[id(conn)] = time.monotonic()
+        return conn
+
+    def _close(self, conn):
+        self.born.pop(id(conn), None)
+        if self.on_close:
+            self.on_close(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _ping(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1")
+        cur.fetchall()
+    finally:
+        cur.close()
+
+
+def _close_quietly(cur):
+    try:
+        cur.close()
+    except Exception:
+        pass
+
+
+def _numbered(sql):
+    """Rewrites %s placeholders as $1, $2, ... for PREPARE"""
+    parts = sql.split("%s")
+    return "".join(
+        part + (f"${i + 1}" if i < len(parts) - 1 else "")
+        for i, part in enumerate(parts)
+    )
+
+
+def _rollback_quietly(conn):
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+
+
+def _insert_sql(table, columns):
+    placeholders = ", ".join(["%s"] * len(columns))
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+def _values_rows(count, width):
+    row = "(" + ", ".join(["%s"] * width) + ")"
+    return ", ".join([row] * count)
+
+
+def _csv_field(value):
+    """COPY csv field: NULL is an unquoted empty field, anything else is quoted"""
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _pool_options(odata):
+    return {
+        "size": odata["pool_size"],
+        "max_overflow": odata.get("max_overflow", 0),
+        "timeout": odata.get("pool_timeout", 5),
+        "recycle": odata.get("pool_recycle", -1),
+        "pre_ping": odata.get("pool_pre_ping", False),
+        "min_size": odata.get("pool_min_size"),
+        "warmup_workers": odata.get("pool_warmup_workers", 4)
+    }
 
-    def __init__(self, factory, size=10):
-        self.pool = Queue(maxsize=size)
-        for _ in range(size):
-            self.pool.put(factory())
 
-    def acquire(self, timeout=5):
+DEFAULT_LANE = "default"
+
+
+class PoolAdapter:
+    """
+    Base of the dialect adapters. Keeps one ConnectionPool per execution lane
+    declared in `odata.lanes`, so a burst of heavy queries can only exhaust
+    its own lane. Each lane overrides any of the `odata` pool settings, and
+    its `pool_size + max_overflow` is the concurrency limit of the lane.
+    Without lanes there is a single "default" one.
+    """
+
+    paramstyle = "format"
+
+    def _build_pools(self, factory, odata, **kwargs):
+        lanes = odata.get("lanes") or {DEFAULT_LANE: {}}
+
+        # per connection LRU of prepared statements, keyed by id(conn)
+        self.statements = {}
+        self.statement_cache_size = odata.get("statement_cache_size", 32)
+
+        self.default_lane = odata.get("default_lane", next(iter(lanes)))
+        self.pools = {
+            name: ConnectionPool(
+                factory,
+                on_close=self._forget_statements,
+                **kwargs,
+                **_pool_options({**odata, **lane})
+            )
+            for name, lane in lanes.items()
+        }
+
+    def render(self, sql):
+        """Converts SQL written with %s placeholders to the driver paramstyle"""
+        if self.paramstyle == "qmark":
+            return sql.replace("%s", "?")
+        return sql
+
+    def run(self, conn, sql, params):
+        """
+        Executes `sql` and returns the cursor together with a flag telling
+        whether it is kept by the statement cache (the caller must not close
+        it then).
+        """
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur, False
+
+    # bound parameters the driver accepts in one statement
+    max_params = 65535
+
+    @contextmanager
+    def transaction(self, conn):
+        """Runs the block in one transaction on an autocommit connection"""
+        conn.autocommit = False
         try:
-            return self.pool.get(timeout=timeout)
-        except Empty:
-            log.error("Timeout while acquiring connection")
-            raise Exception("DB connection pool exhausted")
+            yield
+            conn.commit()
+        except Exception:
+            _rollback_quietly(conn)
+            raise
+        finally:
+            conn.autocommit = True
+
+    def bulk_insert(self, conn, table, groups, chunk_size):
+        """
+        Inserts `groups`, a list of (columns, rows) pairs, in a single
+        transaction sending `chunk_size` rows per round trip. Returns the
+        number of rows inserted.
+
+        This generic path runs executemany per chunk; PyMySQL folds it into
+        multi-row INSERT statements, the other adapters have faster paths.
+        """
+
+        count = 0
+
+        with self.transaction(conn):
+            cur = conn.cursor()
+            try:
+                for columns, rows in groups:
+                    sql = self.render(_insert_sql(table, columns))
+                    for i in range(0, len(rows), chunk_size):
+                        cur.executemany(sql, rows[i:i + chunk_size])
+                    count += len(rows)
+            finally:
+                _close_quietly(cur)
+
+        return count
+
+    def bulk_upsert(self, conn, table, keys, groups, chunk_size):
+        """
+        Inserts or updates by `keys` the rows of `groups`, (columns, rows)
+        pairs, in a single transaction. Each chunk of at most `chunk_size`
+        rows is one statement. Returns the number of rows sent.
+        """
+
+        with self.transaction(conn):
+            cur = conn.cursor()
+            try:
+                return self.upsert_rows(cur, table, keys, groups, chunk_size)
+            finally:
+                _close_quietly(cur)
+
+    def upsert_rows(self, cur, table, keys, groups, chunk_size):
+        """
+        Runs the statements of `bulk_upsert` on `cur`, in the caller's
+        transaction. Each adapter writes its statement in `upsert_sql(table,
+        columns, keys, count)`, with %s placeholders.
+        """
+
+        count = 0
+
+        for columns, rows in groups:
+            size = max(1, min(chunk_size, self.max_params // len(columns)))
+            for i in range(0, len(rows), size):
+                chunk = rows[i:i + size]
+                sql = self.render(self.upsert_sql(table, columns, keys, len(chunk)))
+                cur.execute(sql, [v for row in chunk for v in row])
+            count += len(rows)
 
-    def release(self, conn):
-        self.pool.put(conn)
+        return count
 
+    def acquire(self, lane=None):
+        return self._pool(lane).acquire()
 
+    def release(self, conn, broken=False, lane=None):
+        self._pool(lane).release(conn, broken)
 
-class MSSQLAdapter:
+    def status(self):
+        return {name: pool.status() for name, pool in self.pools.items()}
+
+    def _pool(self, lane):
+        return self.pools.get(lane) or self.pools[self.default_lane]
+
+    def _statements(self, conn):
+        return self.statements.setdefault(id(conn), OrderedDict())
+
+    def _forget_statements(self, conn):
+        self.statements.pop(id(conn), None)
+
+
+# SQLSTATEs reported by pyodbc when the link to SQL Server is gone
+MSSQL_DISCONNECT_STATES = {
+    "01002", "08001", "08003", "08007", "08S01", "08S02", "10054"
+}
+
+# feature_not_supported ("cached plan must not change result type") and
+# invalid_sql_statement_name
+PG_STALE_STATEMENT_CODES = {"0A000", "26000"}
+
+# a multi-row VALUES list changes with the number of rows of each batch, a
+# prepared statement per size would only churn the statement cache
+MULTI_ROW_VALUES = re.compile(r"\bVALUES\s*\([^()]*\)\s*,", re.IGNORECASE)
+
+# PyMySQL error codes for lost, killed or refused connections
+MYSQL_DISCONNECT_CODES = {
+    1927, 2002, 2003, 2006, 2013, 2014, 2045, 2055, 4031
+}
+
+
+class MSSQLAdapter(PoolAdapter):
 
     def __init__(self, cfg, analytics):
 
@@ -44,9 +453,10 @@ class MSSQLAdapter:
                 "TrustServerCertificate=yes;"
             )
 
-            self.pool = ConnectionPool(
+            self._build_pools(
                 lambda: pyodbc.connect(conn_str, autocommit=True),
-                size=odata["pool_size"]
+                odata,
+                is_closed=lambda conn: conn.closed
             )
 
         except Exception as e:
@@ -61,14 +471,92 @@ class MSSQLAdapter:
             )
             raise e
 
-    def acquire(self):
-        return self.pool.acquire()
+    paramstyle = "qmark"
+
+    def run(self, conn, sql, params):
+        """
+        pyodbc keeps the last statement of a cursor prepared and skips
+        SQLPrepare when the same SQL runs again on it, so each connection
+        keeps one cursor per hot statement.
+        """
+
+        if self.statement_cache_size <= 0:
+            return super().run(conn, sql, params)
+
+        statements = self._statements(conn)
+
+        cur = statements.pop(sql, None) or conn.cursor()
+        statements[sql] = cur
+
+        while len(statements) > self.statement_cache_size:
+            _, old = statements.popitem(last=False)
+            _close_quietly(old)
+
+        try:
+            cur.execute(sql, params)
+        except Exception:
+            statements.pop(sql, None)
+            _close_quietly(cur)
+            raise
+
+        return cur, True
+
+    # SQL Server takes at most 2100 parameters per request
+    max_params = 2099
+
+    def bulk_insert(self, conn, table, groups, chunk_size):
+        # fast_executemany sends each chunk as one array of parameters
+        count = 0
+
+        with self.transaction(conn):
+            cur = conn.cursor()
+            cur.fast_executemany = True
+            try:
+                for columns, rows in groups:
+                    sql = self.render(_insert_sql(table, columns))
+                    for i in range(0, len(rows), chunk_size):
+                        cur.executemany(sql, rows[i:i + chunk_size])
+                    count += len(rows)
+            finally:
+                _close_quietly(cur)
+
+        return count
+
+    def upsert_sql(self, table, columns, keys, count):
+        cols = ", ".join(columns)
+        match = " AND ".join(f"target.{k} = source.{k}" for k in keys)
+        updates = [c for c in columns if c not in keys]
+
+        sql = (
+            f"MERGE INTO {table} WITH (HOLDLOCK) AS target "
+            f"USING (VALUES {_values_rows(count, len(columns))}) AS source ({cols}) "
+            f"ON {match}"
+        )
+        if updates:
+            sql += " WHEN MATCHED THEN UPDATE SET " + ", ".join(
+                f"{c} = source.{c}" for c in updates
+            )
+        sql += (
+            f" WHEN NOT MATCHED THEN INSERT ({cols}) "
+            f"VALUES ({', '.join(f'source.{c}' for c in columns)});"
+        )
+        return sql
+
+    def open_stream(self, conn, batch_size):
+        cur = conn.cursor()
+        cur.arraysize = batch_size
+        return cur
 
-    def release(self, conn):
-        self.pool.release(conn)
+    def close_stream(self, conn):
+        pass
 
+    def is_disconnect(self, e, conn):
+        if isinstance(e, pyodbc.Error) and e.args:
+            return str(e.args[0]) in MSSQL_DISCONNECT_STATES
+        return False
 
-class MySQLAdapter:
+
+class MySQLAdapter(PoolAdapter):
 
     def __init__(self, cfg, analytics):
 
@@ -77,7 +565,7 @@ class MySQLAdapter:
             database = cfg["db_mysql"]
             odata = cfg["odata"]
 
-            self.pool = ConnectionPool(
+            self._build_pools(
                 lambda: pymysql.connect(
                     host=database["host"],
                     port=database["port"],
@@ -87,7 +575,9 @@ class MySQLAdapter:
                     autocommit=True,
                     cursorclass=pymysql.cursors.DictCursor
                 ),
-                size=odata["pool_size"]
+                odata,
+                ping=lambda conn: conn.ping(reconnect=False),
+                is_closed=lambda conn: not conn.open
             )
         except Exception as e:
             log.error("Error: {}".format(e))
@@ -101,21 +591,62 @@ class MySQLAdapter:
             )
             raise e
 
-    def acquire(self):
-        return self.pool.acquire()
+    def run(self, conn, sql, params):
+        # PyMySQL only speaks the text protocol, there is no server-side
+        # prepare to cache; a tuple cursor keeps rows in the same shape as
+        # the other dialects
+        cur = conn.cursor(pymysql.cursors.Cursor)
+        cur.execute(sql, params)
+        return cur, False
+
+    @contextmanager
+    def transaction(self, conn):
+        conn.begin()
+        try:
+            yield
+            conn.commit()
+        except Exception:
+            _rollback_quietly(conn)
+            raise
+
+    def upsert_sql(self, table, columns, keys, count):
+        # matches on any unique key of the table, not only `keys`
+        updates = [c for c in columns if c not in keys] or [keys[0]]
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES {_values_rows(count, len(columns))} "
+            f"ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in updates)
+        )
+
+    def open_stream(self, conn, batch_size):
+        # unbuffered cursor, rows are read from the socket as they are fetched
+        return conn.cursor(pymysql.cursors.SSCursor)
 
-    def release(self, conn):
-        self.pool.release(conn)
+    def close_stream(self, conn):
+        pass
 
+    def is_disconnect(self, e, conn):
+        if isinstance(e, pymysql.err.InterfaceError):
+            return True
+        if isinstance(e, pymysql.err.OperationalError) and e.args:
+            return e.args[0] in MYSQL_DISCONNECT_CODES
+        return not conn.open
 
-class PostgresAdapter:
+
+class PostgresAdapter(PoolAdapter):
 
     def __init__(self, cfg, analytics):
         odata = cfg["odata"]
+        self.statement_ids = itertools.count(1)
+
+        # statements PREPARE rejected, e.g. for parameters whose type it
+        # cannot infer (CONCAT($1, ...), $1 IS NULL); they run unprepared
+        self.unpreparable = set()
 
-        self.pool = ConnectionPool(
+        self._build_pools(
             lambda: self._connect(cfg, analytics),
-            size=odata["pool_size"]
+            odata,
+            is_closed=lambda conn: conn.closed != 0
         )
 
     def _connect(self, cfg, analytics):
@@ -144,8 +675,111 @@ class PostgresAdapter:
             )
             raise e
 
-    def acquire(self):
-        return self.pool.acquire()
+    def run(self, conn, sql, params):
+        """
+        Runs hot statements through PREPARE / EXECUTE so the server parses
+        and plans them once per connection. Multi-row inserts and statements
+        PREPARE rejects run unprepared.
+        """
+
+        if self.statement_cache_size <= 0 or sql in self.unpreparable or MULTI_ROW_VALUES.search(sql):
+            return super().run(conn, sql, params)
+
+        statements = self._statements(conn)
+        cur = conn.cursor()
+
+        try:
+            name = statements.pop(sql, None)
+            if name is None:
+                name = f"pulse_{next(self.statement_ids)}"
+                try:
+                    cur.execute(f"PREPARE {name} AS {_numbered(sql)}")
+                except psycopg2.Error as e:
+                    # an error of the server, not of the connection: the
+                    # statement itself cannot be prepared
+                    if getattr(e, "pgcode", None) is None:
+                        raise
+                    _close_quietly(cur)
+                    if len(self.unpreparable) >= 1024:
+                        self.unpreparable.clear()
+                    self.unpreparable.add(sql)
+                    return super().run(conn, sql, params)
+            statements[sql] = name
+
+            while len(statements) > self.statement_cache_size:
+                _, old = statements.popitem(last=False)
+                cur.execute(f"DEALLOCATE {old}")
+
+        except Exception:
+            statements.pop(sql, None)
+            _close_quietly(cur)
+            raise
+
+        try:
+            if params:
+                cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cur.execute(f"EXECUTE {name}")
+
+        except Exception as e:
+            # data errors leave the statement valid, a schema change does not
+            if getattr(e, "pgcode", None) in PG_STALE_STATEMENT_CODES:
+                statements.pop(sql, None)
+                try:
+                    cur.execute(f"DEALLOCATE {name}")
+                except Exception:
+                    pass
+            _close_quietly(cur)
+            raise
+
+        return cur, False
+
+    def bulk_insert(self, conn, table, groups, chunk_size):
+        # each chunk is streamed as csv through COPY FROM STDIN
+        count = 0
+
+        with self.transaction(conn):
+            cur = conn.cursor()
+            try:
+                for columns, rows in groups:
+                    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+                    for i in range(0, len(rows), chunk_size):
+                        buf = io.StringIO()
+                        for row in rows[i:i + chunk_size]:
+                            buf.write(",".join(_csv_field(v) for v in row))
+                            buf.write("\n")
+                        buf.seek(0)
+                        cur.copy_expert(sql, buf)
+                    count += len(rows)
+            finally:
+                _close_quietly(cur)
+
+        return count
+
+    def upsert_sql(self, table, columns, keys, count):
+        updates = [c for c in columns if c not in keys]
+        action = "DO NOTHING"
+        if updates:
+            action = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES {_values_rows(count, len(columns))} "
+            f"ON CONFLICT ({', '.join(keys)}) {action}"
+        )
 
-    def release(self, conn):
-        self.pool.release(conn)
+    def open_stream(self, conn, batch_size):
+        # named cursors only live inside a transaction
+        conn.autocommit = False
+        cur = conn.cursor(name=f"pulse_{uuid.uuid4().hex}")
+        cur.itersize = batch_size
+        return cur
+
+    def close_stream(self, conn):
+        conn.rollback()
+        conn.autocommit = True
+
+    def is_disconnect(self, e, conn):
+        # psycopg2 marks the connection closed when the server link is lost
+        if isinstance(e, psycopg2.InterfaceError):
+            return True
+        return conn.closed != 0
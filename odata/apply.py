@@ -0,0 +1,277 @@
+"""
+OData $apply: a pipeline of transformations separated by "/".
+
+    filter(<condition>)
+    compute(<expression> as <alias>, ...)
+    groupby((<column>, ...)[, aggregate(...)])
+    aggregate(<expression> with <method> as <alias>, ..., $count as <alias>)
+
+with the methods sum, average (or avg), min, max and countdistinct. The
+pipeline is parsed into a hashable tree like $filter, and compiled into one
+SELECT; every transformation that needs a new scope wraps the SQL built so
+far in a derived table, which the databases flatten again when they can.
+
+Nodes:
+    ("filter", tree)
+    ("compute", ((expression, alias), ...))
+    ("groupby", (column, ...), ((expression or None, method, alias), ...))
+"""
+from odata.filter import FilterCompiler, FilterParser, tokenize
+from odata.literals import InvalidQuery
+
+TRANSFORMATIONS = ("filter", "compute", "groupby", "aggregate")
+METHODS = {"sum": "sum", "average": "average", "avg": "average", "min": "min", "max": "max",
+           "countdistinct": "countdistinct"}
+
+COMMA, SLASH = ("punct", ","), ("punct", "/")
+
+
+def _invalid(message):
+    return InvalidQuery(f"Invalid $apply: {message}")
+
+
+class ApplyParser(FilterParser):
+
+    def transformations(self):
+        steps = [self.transformation()]
+
+        while self.tokens[self.pos] == SLASH:
+            self.pos += 1
+            steps.append(self.transformation())
+
+        kind, value = self.tokens[self.pos]
+        if kind is not None:
+            raise _invalid(f"unexpected '{value}'")
+
+        return tuple(steps)
+
+    def transformation(self):
+        kind, name = self.tokens[self.pos]
+        if kind != "name" or name not in TRANSFORMATIONS:
+            raise _invalid(f"unknown transformation '{name}'")
+        self.pos += 1
+        self.expect("(")
+
+        if name == "filter":
+            step = ("filter", self.expr(0))
+
+        elif name == "compute":
+            step = ("compute", self.listed(self.computed))
+
+        elif name == "aggregate":
+            step = ("groupby", (), self.listed(self.aggregate))
+
+        else:
+            self.expect("(")
+            columns = self.listed(self.name)
+            self.expect(")")
+
+            aggregates = ()
+            if self.tokens[self.pos] == COMMA:
+                self.pos += 1
+                self.word("aggregate")
+                self.expect("(")
+                aggregates = self.listed(self.aggregate)
+                self.expect(")")
+
+            step = ("groupby", columns, aggregates)
+
+        self.expect(")")
+        return step
+
+    def listed(self, item):
+        items = [item()]
+        while self.tokens[self.pos] == COMMA:
+            self.pos += 1
+            items.append(item())
+        return tuple(items)
+
+    def word(self, word):
+        if self.tokens[self.pos] != ("name", word):
+            raise _invalid(f"expected '{word}'")
+        self.pos += 1
+
+    def name(self):
+        kind, value = self.tokens[self.pos]
+        if kind != "name" or value.startswith("$"):
+            raise _invalid("expected a name")
+        self.pos += 1
+        return value
+
+    def alias(self):
+        self.word("as")
+        return self.name()
+
+    def computed(self):
+        expression = self.expr(0)
+        return expression, self.alias()
+
+    def aggregate(self):
+        if self.tokens[self.pos] == ("name", "$count"):
+            self.pos += 1
+            return None, "count", self.alias()
+
+        expression = self.expr(0)
+        self.word("with")
+
+        kind, method = self.tokens[self.pos]
+        if kind != "name" or method not in METHODS:
+            raise _invalid(f"unknown aggregation method '{method}'")
+        self.pos += 1
+
+        return expression, METHODS[method], self.alias()
+
+
+def parse_apply(text):
+    """The tree of a $apply and its literal values, as text, like `parse_filter`"""
+
+    parser = ApplyParser(tokenize(text))
+    steps = parser.transformations()
+    return steps, parser.literals
+
+
+class _Level:
+    """One SELECT of the pipeline: SQL fragments with the slots they bind"""
+
+    def __init__(self, source, columns):
+        self.select = None
+        self.source = source
+        self.where = []
+        self.group_by = None
+        self.columns = columns
+
+    def render(self):
+        sql, slots, converters = self.source
+        select_sql = "*"
+        parts_slots = []
+        parts_converters = []
+
+        if self.select is not None:
+            select_sql, select_slots, select_converters = self.select
+            parts_slots += select_slots
+            parts_converters += select_converters
+
+        text = f"SELECT {select_sql} FROM {sql}"
+        parts_slots += slots
+        parts_converters += converters
+
+        if self.where:
+            text += " WHERE " + " AND ".join(f"({w})" for w, _, _ in self.where)
+            for _, where_slots, where_converters in self.where:
+                parts_slots += where_slots
+                parts_converters += where_converters
+
+        if self.group_by:
+            text += " GROUP BY " + ", ".join(self.group_by)
+
+        return text, parts_slots, parts_converters
+
+
+class _ApplyCompiler:
+
+    def __init__(self, table_name, columns, dialect):
+        self.dialect = dialect
+        self.aliases = 0
+        self.level = _Level((f"{table_name} AS t0", [], []), dict(columns))
+
+    def compiler(self):
+        return FilterCompiler(self.level.columns, self.dialect)
+
+    def wrap(self):
+        """Starts a new SELECT over the current one"""
+
+        sql, slots, converters = self.level.render()
+        self.aliases += 1
+        self.level = _Level((f"({sql}) AS t{self.aliases}", slots, converters), self.level.columns)
+
+    def filter(self, tree):
+        if self.level.select is not None:
+            self.wrap()
+
+        compiler = self.compiler()
+        sql = compiler.predicate(tree)
+        self.level.where.append((sql, compiler.slots, compiler.converters))
+
+    def compute(self, items):
+        if self.level.select is not None:
+            self.wrap()
+
+        compiler = self.compiler()
+        columns = dict(self.level.columns)
+        select = [f"t{self.aliases}.*"]
+
+        for expression, alias in items:
+            if alias in columns:
+                raise _invalid(f"'{alias}' is already a column")
+            select.append(f"{compiler.value(expression)} AS {alias}")
+            columns[alias] = {"type": (compiler.type_of(expression) or (None,))[0]}
+
+        self.level.select = (", ".join(select), compiler.slots, compiler.converters)
+        self.level.columns = columns
+
+    def groupby(self, group, aggregates):
+        if self.level.select is not None:
+            self.wrap()
+
+        compiler = self.compiler()
+        columns = {}
+        select = []
+
+        for name in group:
+            columns[name] = compiler.column(name)
+            select.append(name)
+
+        for expression, method, alias in aggregates:
+            if alias in columns:
+                raise _invalid(f"'{alias}' is already a column")
+            sql, db_type = self.aggregate(compiler, expression, method)
+            select.append(f"{sql} AS {alias}")
+            columns[alias] = {"type": db_type}
+
+        if not select:
+            raise _invalid("groupby needs columns or aggregates")
+
+        self.level.select = (", ".join(select), compiler.slots, compiler.converters)
+        self.level.group_by = list(group)
+        self.level.columns = columns
+
+    def aggregate(self, compiler, expression, method):
+        """SQL and result type of one aggregate"""
+
+        if method == "count":
+            return "COUNT(*)", "bigint"
+
+        db_type = (compiler.type_of(expression) or (None,))[0]
+        value = compiler.value(expression)
+
+        if method == "countdistinct":
+            return f"COUNT(DISTINCT {value})", "bigint"
+
+        if method == "average":
+            # SQL Server averages integers as integers
+            if self.dialect == "mssql":
+                return f"AVG({value} * 1.0)", "decimal"
+            return f"AVG({value})", "decimal"
+
+        return f"{method.upper()}({value})", db_type
+
+
+def compile_apply(steps, table_name, columns, dialect):
+    """
+    SELECT producing the rows of a parsed $apply over `table_name`, the
+    literal slot and converter of each of its placeholders, and the columns
+    of its rows ({name: {"type": ...}}).
+    """
+
+    compiler = _ApplyCompiler(table_name, columns, dialect)
+
+    for step in steps:
+        if step[0] == "filter":
+            compiler.filter(step[1])
+        elif step[0] == "compute":
+            compiler.compute(step[1])
+        else:
+            compiler.groupby(step[1], step[2])
+
+    sql, slots, converters = compiler.level.render()
+    return sql, slots, converters, compiler.level.columns
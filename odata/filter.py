@@ -0,0 +1,515 @@
+"""
+OData $filter expressions: a tokenizer, a recursive descent parser producing
+a hashable syntax tree with the literals taken out, and a compiler turning
+the tree into parameterized SQL for each dialect.
+
+The tree only depends on the shape of the expression, so it is a plan cache
+key; the literals of each request are bound to its slots.
+
+Nodes:
+    ("col", name)
+    ("lit", index, kind)        kind: string number date datetime time guid bool
+    ("null",)
+    ("cmp", op, left, right)    op: eq ne gt ge lt le like
+    ("in", expr, (items, ...))
+    ("and", left, right) / ("or", left, right) / ("not", expr)
+    ("arith", op, left, right)  op: add sub mul div divby mod
+    ("neg", expr)
+    ("call", name, (args, ...))
+"""
+import datetime
+import decimal
+import re
+
+from odata.literals import InvalidQuery, literal_converter, literal_parser
+
+# most frequent tokens first; a guid must be tried before a name or number
+TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<punct>[(),/-])
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<guid>[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}(?![\w-]))
+      | (?P<name>\$?[A-Za-z_]\w*)
+      | (?P<datetime>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:\d{2})?)
+      | (?P<date>\d{4}-\d{2}-\d{2}(?![\w:]))
+      | (?P<time>\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)
+      | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w.]))
+      | (?P<dstring>"[^"]*")
+      | (?P<error>\S)
+    )""", re.X)
+
+COMPARISONS = {"eq": "=", "ne": "<>", "gt": ">", "ge": ">=", "lt": "<", "le": "<=", "like": "LIKE"}
+ADDITIVE = {"add": "+", "sub": "-"}
+MULTIPLICATIVE = {"mul": "*", "div": "/", "divby": "/", "mod": None}
+CONSTANTS = {"true": "bool", "false": "bool"}
+
+# binding power of the infix operators, a higher one binds tighter; "not"
+# binds looser than a comparison, so `not a eq 1` negates the comparison
+OR_POWER, AND_POWER, NOT_POWER, COMPARISON_POWER = 1, 2, 3, 4
+POWERS = {"or": OR_POWER, "and": AND_POWER, "in": COMPARISON_POWER}
+POWERS.update(dict.fromkeys(COMPARISONS, COMPARISON_POWER))
+POWERS.update(dict.fromkeys(ADDITIVE, 5))
+POWERS.update(dict.fromkeys(MULTIPLICATIVE, 6))
+
+END = (None, None)
+OPEN, CLOSE, COMMA = ("punct", "("), ("punct", ")"), ("punct", ",")
+
+# name: (min args, max args, result type)
+FUNCTIONS = {
+    "contains": (2, 2, "bool"),
+    "startswith": (2, 2, "bool"),
+    "endswith": (2, 2, "bool"),
+    "length": (1, 1, "int"),
+    "indexof": (2, 2, "int"),
+    "substring": (2, 3, None),
+    "tolower": (1, 1, None),
+    "toupper": (1, 1, None),
+    "trim": (1, 1, None),
+    "concat": (2, 2, None),
+    "year": (1, 1, "int"),
+    "month": (1, 1, "int"),
+    "day": (1, 1, "int"),
+    "hour": (1, 1, "int"),
+    "minute": (1, 1, "int"),
+    "second": (1, 1, "int"),
+    "date": (1, 1, "date"),
+    "time": (1, 1, "time"),
+    "round": (1, 1, None),
+    "floor": (1, 1, None),
+    "ceiling": (1, 1, None),
+    "now": (0, 0, "datetime"),
+}
+
+PARTS = {"year": "YEAR", "month": "MONTH", "day": "DAY", "hour": "HOUR", "minute": "MINUTE", "second": "SECOND"}
+
+
+def _invalid(message):
+    return InvalidQuery(f"Invalid $filter: {message}")
+
+
+def tokenize(text):
+    """List of (kind, value) tokens, string literals already unquoted"""
+
+    tokens = []
+
+    for match in TOKEN.finditer(text):
+        kind = match.lastgroup
+        value = match.group(kind)
+
+        if kind == "string":
+            value = value[1:-1].replace("''", "'")
+        elif kind == "error":
+            raise _invalid(f"unexpected character at position {match.start(kind) + 1}")
+        elif kind == "dstring":
+            kind, value = "string", value[1:-1]
+
+        tokens.append((kind, value))
+
+    return tokens
+
+
+class FilterParser:
+    """
+    Precedence climbing over the token list: one loop per level of nesting
+    instead of one call per precedence level keeps long flat expressions
+    cheap.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens + [END]
+        self.pos = 0
+        self.literals = []
+
+    def expect(self, value):
+        kind, got = self.tokens[self.pos]
+        if kind != "punct" or got != value:
+            raise _invalid(f"expected '{value}'" + (f" before '{got}'" if got else " at the end"))
+        self.pos += 1
+
+    def literal(self, kind, value):
+        self.literals.append(value)
+        return "lit", len(self.literals) - 1, kind
+
+    def parse(self):
+        node = self.expr(0)
+        kind, value = self.tokens[self.pos]
+        if kind is not None:
+            raise _invalid(f"unexpected '{value}'")
+        return node
+
+    def expr(self, min_power):
+        tokens = self.tokens
+        kind, value = tokens[self.pos]
+
+        if kind == "name" and value == "not":
+            self.pos += 1
+            node = ("not", self.expr(NOT_POWER))
+        elif kind == "punct" and value == "-":
+            self.pos += 1
+            node = self.negative()
+        else:
+            node = self.primary()
+
+        while True:
+            kind, value = tokens[self.pos]
+            if kind != "name":
+                return node
+
+            power = POWERS.get(value)
+            if power is None or power <= min_power:
+                return node
+            self.pos += 1
+
+            if value == "in":
+                node = ("in", node, self.items())
+            elif power == COMPARISON_POWER:
+                node = ("cmp", value, node, self.expr(power))
+            elif power <= AND_POWER:
+                node = (value, node, self.expr(power))
+            else:
+                node = ("arith", value, node, self.expr(power))
+
+    def negative(self):
+        kind, value = self.tokens[self.pos]
+        # a negative number is one literal
+        if kind == "number":
+            self.pos += 1
+            return self.literal("number", "-" + value)
+        if kind == "punct" and value == "-":
+            self.pos += 1
+            return "neg", self.negative()
+        return "neg", self.primary()
+
+    def items(self):
+        self.expect("(")
+        items = [self.expr(COMPARISON_POWER)]
+        while self.tokens[self.pos] == COMMA:
+            self.pos += 1
+            items.append(self.expr(COMPARISON_POWER))
+        self.expect(")")
+        return tuple(items)
+
+    def primary(self):
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+
+        if kind is None:
+            raise _invalid("unexpected end of expression")
+
+        if kind == "punct":
+            if value != "(":
+                raise _invalid(f"unexpected '{value}'")
+            node = self.expr(0)
+            self.expect(")")
+            return node
+
+        if kind != "name":
+            return self.literal(kind, value)
+
+        if value == "null":
+            return ("null",)
+
+        if value in CONSTANTS:
+            return self.literal(CONSTANTS[value], value)
+
+        if self.tokens[self.pos] == OPEN:
+            self.pos += 1
+            args = []
+            if self.tokens[self.pos] != CLOSE:
+                args.append(self.expr(0))
+                while self.tokens[self.pos] == COMMA:
+                    self.pos += 1
+                    args.append(self.expr(0))
+            self.expect(")")
+            return "call", value, tuple(args)
+
+        return "col", value
+
+
+def parse_filter(text):
+    """
+    Parses a $filter into its tree and the list of its literal values, as
+    text, in the order of their slots.
+    """
+
+    parser = FilterParser(tokenize(text))
+    tree = parser.parse()
+    return tree, parser.literals
+
+
+def _number(value):
+    if "e" in value or "E" in value:
+        return float(value)
+    if "." in value:
+        return decimal.Decimal(value)
+    return int(value)
+
+
+# literals compared with nothing typed keep the type of their token
+KIND_CONVERTERS = {
+    "string": None,
+    "number": _number,
+    "date": literal_parser("date"),
+    "datetime": datetime.datetime.fromisoformat,
+    "time": literal_parser("time with time zone"),
+    "guid": literal_parser("uuid"),
+    "bool": literal_parser("boolean"),
+}
+
+
+class FilterCompiler:
+
+    def __init__(self, columns, dialect):
+        self.columns = columns
+        self.dialect = dialect
+        self.slots = []
+        self.converters = []
+
+    def bind(self, node, peer=None, convert=None):
+        """Placeholder of a literal; `peer` is the (type, column) it is compared with"""
+
+        _, index, kind = node
+
+        if convert is None:
+            if peer is not None and peer[0] is not None:
+                convert = literal_converter(peer[1] or "expression", peer[0])
+            else:
+                convert = KIND_CONVERTERS[kind]
+
+        self.slots.append(index)
+        self.converters.append(convert)
+        return "%s"
+
+    def type_of(self, node):
+        """(database type, column) of a value expression, None when unknown"""
+
+        tag = node[0]
+
+        if tag == "col":
+            column = self.column(node[1])
+            return column["type"], node[1]
+
+        if tag == "call":
+            result = FUNCTIONS.get(node[1], (0, 0, None))[2]
+            return (result, None) if result and result != "bool" else None
+
+        if tag == "arith":
+            for side in (node[2], node[3]):
+                if side[0] != "lit":
+                    return self.type_of(side)
+
+        if tag == "neg":
+            return self.type_of(node[1])
+
+        return None
+
+    def column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            raise _invalid(f"unknown column '{name}'")
+        return column
+
+    # ----- boolean expressions -----
+
+    def predicate(self, node):
+        tag = node[0]
+
+        if tag in ("and", "or"):
+            return f"({self.predicate(node[1])} {tag.upper()} {self.predicate(node[2])})"
+
+        if tag == "not":
+            return f"NOT ({self.predicate(node[1])})"
+
+        if tag == "cmp":
+            return self.comparison(*node[1:])
+
+        if tag == "in":
+            peer = self.type_of(node[1])
+            expr = self.value(node[1])
+            items = ", ".join(self.value(item, peer) for item in node[2])
+            return f"{expr} IN ({items})"
+
+        if tag == "call" and FUNCTIONS.get(node[1], (0, 0, "bool"))[2] == "bool":
+            return self.call(node[1], node[2])
+
+        raise _invalid("expected a condition")
+
+    def comparison(self, op, left, right):
+
+        if right == ("null",) or left == ("null",):
+            if op not in ("eq", "ne"):
+                raise _invalid(f"'{op}' cannot compare with null")
+            other = left if right == ("null",) else right
+            if other == ("null",):
+                raise _invalid("null compared with null")
+            return f"{self.value(other)} IS {'NOT ' if op == 'ne' else ''}NULL"
+
+        if op == "like":
+            # patterns are bound as they are
+            return f"{self.value(left)} LIKE {self.value(right, convert=str)}"
+
+        left_sql = self.value(left, self.type_of(right))
+        right_sql = self.value(right, self.type_of(left))
+        return f"{left_sql} {COMPARISONS[op]} {right_sql}"
+
+    # ----- value expressions -----
+
+    def value(self, node, peer=None, convert=None):
+        tag = node[0]
+
+        if tag == "lit":
+            return self.bind(node, peer, convert)
+
+        if tag == "col":
+            self.column(node[1])
+            return node[1]
+
+        if tag == "null":
+            return "NULL"
+
+        if tag == "neg":
+            return f"(-{self.value(node[1])})"
+
+        if tag == "arith":
+            _, op, left, right = node
+            left_sql = self.value(left, self.type_of(right))
+            right_sql = self.value(right, self.type_of(left))
+            if op == "mod":
+                # a % in the statement text would clash with the paramstyle
+                if self.dialect == "mssql":
+                    return f"({left_sql} % {right_sql})"
+                return f"MOD({left_sql}, {right_sql})"
+            return f"({left_sql} {MULTIPLICATIVE.get(op) or ADDITIVE[op]} {right_sql})"
+
+        if tag == "call":
+            if FUNCTIONS.get(node[1], (0, 0, None))[2] == "bool":
+                raise _invalid(f"{node[1]}() is a condition, not a value")
+            return self.call(node[1], node[2])
+
+        raise _invalid("expected a value")
+
+    def call(self, name, args):
+        """
+        SQL of a function call. Arguments are compiled where they appear in
+        the SQL text, in order, so the placeholders follow their slots; an
+        argument used twice is compiled twice.
+        """
+
+        spec = FUNCTIONS.get(name)
+        if spec is None:
+            raise _invalid(f"unknown function '{name}'")
+
+        low, high, _ = spec
+        if not low <= len(args) <= high:
+            raise _invalid(f"{name}() takes {low if low == high else f'{low} to {high}'} arguments")
+
+        dialect = self.dialect
+        value = self.value
+
+        if name in ("contains", "startswith", "endswith"):
+            return self.match(name, *args)
+
+        if name in ("tolower", "toupper"):
+            return f"{'LOWER' if name == 'tolower' else 'UPPER'}({value(args[0])})"
+
+        if name == "trim":
+            if dialect == "mssql":
+                return f"LTRIM(RTRIM({value(args[0])}))"
+            return f"TRIM({value(args[0])})"
+
+        if name == "length":
+            return self.length(args[0])
+
+        if name == "concat":
+            return f"CONCAT({value(args[0])}, {value(args[1])})"
+
+        if name == "indexof":
+            return f"({self.position(args[1], args[0])} - 1)"
+
+        if name == "substring":
+            # OData positions start at 0
+            start = f"{value(args[0])}, {value(args[1])} + 1"
+            if len(args) == 3:
+                return f"SUBSTRING({start}, {value(args[2])})"
+            if dialect == "mssql":
+                return f"SUBSTRING({start}, {self.length(args[0])})"
+            return f"SUBSTRING({start})"
+
+        if name in PARTS:
+            part = PARTS[name]
+            if dialect == "mssql":
+                return f"DATEPART({part.lower()}, {value(args[0])})"
+            if dialect == "mysql":
+                return f"{part}({value(args[0])})"
+            # EXTRACT returns numeric, a computed part should read as an int
+            return f"CAST(FLOOR(EXTRACT({part} FROM {value(args[0])})) AS INTEGER)"
+
+        if name in ("date", "time"):
+            return f"CAST({value(args[0])} AS {name.upper()})"
+
+        if name == "round":
+            if dialect == "mssql":
+                return f"ROUND({value(args[0])}, 0)"
+            return f"ROUND({value(args[0])})"
+
+        if name in ("floor", "ceiling"):
+            return f"{name.upper()}({value(args[0])})"
+
+        return "CURRENT_TIMESTAMP"
+
+    def length(self, node):
+        function = {"mssql": "LEN", "mysql": "CHAR_LENGTH"}.get(self.dialect, "LENGTH")
+        return f"{function}({self.value(node)})"
+
+    def position(self, needle, haystack):
+        """1-based position of `needle` in `haystack`, 0 when it is missing"""
+
+        if self.dialect == "postgres":
+            haystack_sql = self.value(haystack)
+            return f"STRPOS({haystack_sql}, {self.value(needle)})"
+
+        function = "CHARINDEX" if self.dialect == "mssql" else "LOCATE"
+        needle_sql = self.value(needle)
+        return f"{function}({needle_sql}, {self.value(haystack)})"
+
+    def match(self, name, subject, pattern):
+
+        if pattern[0] == "lit":
+            # a literal becomes a LIKE pattern, which can use an index for
+            # startswith
+            escape = self.escape
+            if name == "contains":
+                convert = lambda v: "%" + escape(v) + "%"
+            elif name == "startswith":
+                convert = lambda v: escape(v) + "%"
+            else:
+                convert = lambda v: "%" + escape(v)
+            subject_sql = self.value(subject)
+            return f"{subject_sql} LIKE {self.bind(pattern, convert=convert)} ESCAPE '!'"
+
+        if name == "contains":
+            return f"{self.position(pattern, subject)} > 0"
+        if name == "startswith":
+            return f"{self.position(pattern, subject)} = 1"
+
+        subject_sql = self.value(subject)
+        length_sql = self.length(pattern)
+        return f"RIGHT({subject_sql}, {length_sql}) = {self.value(pattern)}"
+
+    def escape(self, value):
+        value = str(value).replace("!", "!!").replace("%", "!%").replace("_", "!_")
+        if self.dialect == "mssql":
+            value = value.replace("[", "![")
+        return value
+
+
+def compile_filter(tree, columns, dialect):
+    """
+    SQL condition of a parsed $filter on a table with `columns`, the literal
+    slot bound to each of its placeholders and the converter of each slot
+    (None to bind the text as it is).
+    """
+
+    compiler = FilterCompiler(columns, dialect)
+    sql = compiler.predicate(tree)
+    return sql, compiler.slots, compiler.converters
@@ -0,0 +1,136 @@
+import datetime
+import decimal
+import math
+import re
+import uuid
+
+INTEGER_TYPES = {"int", "integer", "smallint", "bigint", "tinyint", "mediumint", "year"}
+DECIMAL_TYPES = {"decimal", "numeric", "money", "smallmoney"}
+FLOAT_TYPES = {"float", "real", "double", "double precision"}
+BOOL_TYPES = {"bit", "boolean", "bool"}
+DATE_TYPES = {"date"}
+DATETIME_TYPES = {
+    "datetime", "datetime2", "smalldatetime", "datetimeoffset", "timestamp",
+    "timestamp without time zone", "timestamp with time zone"
+}
+TIME_TYPES = {"time", "time without time zone", "time with time zone"}
+UUID_TYPES = {"uuid", "uniqueidentifier"}
+
+# column types whose values carry an offset, the others compare wall-clock time
+ZONED_TYPES = {"datetimeoffset", "timestamp with time zone", "time with time zone"}
+
+INTEGER = re.compile(r"[+-]?\d+")
+
+
+class InvalidQuery(RuntimeError):
+    """A query option the client got wrong, answered with a 400"""
+
+
+def _integer(value):
+    if not INTEGER.fullmatch(value):
+        raise ValueError(value)
+    return int(value)
+
+
+def _decimal(value):
+    number = decimal.Decimal(value)
+    if not number.is_finite():
+        raise ValueError(value)
+    return number
+
+
+def _float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def _bool(value):
+    value = value.lower()
+    if value in ("true", "1"):
+        return True
+    if value in ("false", "0"):
+        return False
+    raise ValueError(value)
+
+
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        # a timestamp is cut to its date, as the database's own cast does
+        return datetime.datetime.fromisoformat(value).date()
+
+
+def _datetime(value, zoned):
+    parsed = datetime.datetime.fromisoformat(value)
+    # the offset of a literal used to be ignored by the database's own cast
+    if not zoned and parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None)
+    return parsed
+
+
+def _time(value, zoned):
+    parsed = datetime.time.fromisoformat(value)
+    if not zoned and parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None)
+    return parsed
+
+
+def _uuid(value):
+    # bound as canonical text, the drivers do not all adapt uuid.UUID
+    return str(uuid.UUID(value))
+
+
+def literal_parser(db_type):
+    """
+    Parser of a literal given as text into the Python value the drivers bind
+    with the type of a `db_type` column, or None for text and unknown
+    types, whose literals are bound as they are.
+    """
+
+    db_type = (db_type or "").lower()
+    zoned = db_type in ZONED_TYPES
+
+    if db_type in INTEGER_TYPES:
+        return _integer
+    if db_type in DECIMAL_TYPES:
+        return _decimal
+    if db_type in FLOAT_TYPES:
+        return _float
+    if db_type in BOOL_TYPES:
+        return _bool
+    if db_type in DATE_TYPES:
+        return _date
+    if db_type in DATETIME_TYPES:
+        return lambda value: _datetime(value, zoned)
+    if db_type in TIME_TYPES:
+        return lambda value: _time(value, zoned)
+    if db_type in UUID_TYPES:
+        return _uuid
+
+    return None
+
+
+def literal_converter(column, db_type):
+    """
+    Converter of the literals compared with `column`: text is parsed for the
+    column type and rejected when it does not parse, values that are already
+    typed (decoded from a $skiptoken) pass through. None when the literals
+    are bound unchanged.
+    """
+
+    parse = literal_parser(db_type)
+    if parse is None:
+        return None
+
+    def convert(value):
+        if not isinstance(value, str):
+            return value
+        try:
+            return parse(value.strip())
+        except (ValueError, ArithmeticError):
+            raise InvalidQuery(f"Invalid literal '{value}' for column '{column}' of type {db_type}")
+
+    return convert
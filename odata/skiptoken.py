@@ -0,0 +1,35 @@
+import base64
+import json
+
+from odata.literals import InvalidQuery
+
+
+class InvalidSkiptoken(InvalidQuery):
+    """A $skiptoken that this server did not issue for the requested sort"""
+
+
+def encode_skiptoken(values):
+    """
+    Opaque $skiptoken holding the sort key values of the last row of a page.
+    Values that JSON cannot represent (dates, decimals, uuids) travel as
+    strings, the database converts them back when they are bound.
+    """
+    raw = json.dumps(list(values), default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_skiptoken(token, expected):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise InvalidSkiptoken("Invalid $skiptoken")
+
+    if not isinstance(values, list) or len(values) != expected:
+        raise InvalidSkiptoken("Invalid $skiptoken")
+
+    # the tokens of this server only hold JSON scalars
+    if any(isinstance(v, (list, dict)) for v in values):
+        raise InvalidSkiptoken("Invalid $skiptoken")
+
+    return values
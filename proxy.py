@@ -1,6 +1,9 @@
 import ssl
-import requests
+import threading
+from http.client import HTTPConnection, RemoteDisconnected
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from queue import Queue, Empty, Full
 from flask import json
 from utils import CONFIG_PATH
 from analytics.logger import setup_logger
@@ -12,34 +15,247 @@ with open(CONFIG_PATH) as f:
     server_cfg = cfg["server"]
     secure_cfg = cfg["security"]
 
+
+# headers that only make sense for a single hop and must not be forwarded
+HOP_BY_HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+class UpstreamPool:
+    """
+    Bounded pool of persistent HTTP/1.1 connections to the internal server.
+    At most `size` connections are open at the same time; idle ones are kept
+    alive and reused by the next request.
+    """
+
+    def __init__(self, host, port, size=24, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = Queue(maxsize=size)
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            log.error("Timeout while acquiring upstream connection")
+            raise Exception("Upstream connection pool exhausted")
+
+        try:
+            return self.idle.get_nowait(), True
+        except Empty:
+            return self._connect(), False
+
+    def release(self, conn, reuse=True):
+        try:
+            if reuse:
+                self.idle.put_nowait(conn)
+            else:
+                conn.close()
+        except Full:
+            conn.close()
+        finally:
+            self.slots.release()
+
+    def _connect(self):
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+
+class RequestBody:
+    """
+    Iterates over the client request body in chunks of at most `buffer_size`
+    bytes, so uploads are forwarded to the internal server without being
+    held in memory. Supports both Content-Length and chunked bodies.
+    """
+
+    def __init__(self, rfile, length=None, chunked=False, buffer_size=65536):
+        self.rfile = rfile
+        self.length = length
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.started = False
+
+    def __iter__(self):
+        self.started = True
+
+        if self.chunked:
+            yield from self._read_chunked()
+        else:
+            yield from self._read(self.length)
+
+    def _read(self, remaining):
+        while remaining:
+            data = self.rfile.read(min(self.buffer_size, remaining))
+            if not data:
+                raise ConnectionError("Client closed connection while sending body")
+            remaining -= len(data)
+            yield data
+
+    def _read_chunked(self):
+        while True:
+            line = self.rfile.readline(65537)
+            size = int(line.split(b";", 1)[0].strip(), 16)
+
+            if size == 0:
+                # discard trailers up to the final empty line
+                while self.rfile.readline(65537) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+
+            yield from self._read(size)
+            self.rfile.readline()
+
+
 class ReverseProxyHandler(BaseHTTPRequestHandler):
 
+    protocol_version = "HTTP/1.1"
+
     def _proxy(self):
 
+        # at most `proxy_threads` requests are relayed at the same time, an
+        # idle keep-alive connection does not count
+        if not self.server.active.acquire(timeout=self.server.upstream.timeout):
+            log.error("Timeout while waiting for a proxy slot")
+            self.close_connection = True
+            self.send_error(503, "Service unavailable")
+            return
+
+        try:
+            self._relay()
+        finally:
+            self.server.active.release()
+
+
+    def _relay(self):
+
+        upstream = self.server.upstream
+
+        try:
+            headers = {
+                k: v for k, v in self.headers.items()
+                if k.lower() not in HOP_BY_HOP and k.lower() != "expect"
+            }
+            conn, resp = self._forward(headers, self._request_body())
+
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            self.close_connection = True
+            self.send_error(502, "Bad gateway")
+            return
+
         try:
-            url = f"http://{server_cfg["internal_host"]}:{server_cfg["internal_port"]}{self.path}"
-
-            headers = {k: v for k, v in self.headers.items()}
-            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
-
-            resp = requests.request(
-                method=self.command,
-                url=url,
-                headers=headers,
-                data=body,
-                stream=True
-            )
-
-            self.send_response(resp.status_code)
-            for k, v in resp.headers.items():
-                if k.lower() != "transfer-encoding":
-                    self.send_header(k, v)
-            self.end_headers()
-            self.wfile.write(resp.content)
+            self._stream_response(resp)
+            upstream.release(conn, reuse=not resp.will_close)
 
         except Exception as e:
+            # headers are already sent, the only option left is to drop the client
             log.error("Error: {}".format(e))
-            raise e
+            upstream.release(conn, reuse=False)
+            self.close_connection = True
+
+
+    def _request_body(self):
+
+        buffer_size = self.server.buffer_size
+
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            return RequestBody(self.rfile, chunked=True, buffer_size=buffer_size)
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            return RequestBody(self.rfile, length=length, buffer_size=buffer_size)
+
+        return None
+
+
+    def _forward(self, headers, body):
+        """
+        Sends the request through a pooled upstream connection. A reused
+        connection may have been closed by waitress while idle, in that case
+        the request is retried once on a fresh connection, as long as no part
+        of the body was consumed yet.
+        """
+
+        upstream = self.server.upstream
+
+        for attempt in range(2):
+            conn, reused = upstream.acquire()
+            try:
+                conn.request(self.command, self.path, body=body, headers=headers)
+                return conn, conn.getresponse()
+
+            except (RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                upstream.release(conn, reuse=False)
+                if not reused or attempt or (body and body.started):
+                    raise e
+
+            except Exception as e:
+                upstream.release(conn, reuse=False)
+                raise e
+
+
+    def _stream_response(self, resp):
+        """
+        Relays the upstream response in chunks of at most `buffer_size` bytes.
+        When the upstream length is unknown the body is re-chunked for
+        HTTP/1.1 clients, or delimited by closing the connection otherwise.
+        """
+
+        length = resp.getheader("Content-Length")
+        has_body = (
+            self.command != "HEAD"
+            and resp.status not in (204, 304)
+            and resp.status >= 200
+        )
+        chunked = has_body and length is None and self.request_version == "HTTP/1.1"
+
+        self.send_response(resp.status, resp.reason)
+        for k, v in resp.getheaders():
+            if k.lower() not in HOP_BY_HOP:
+                self.send_header(k, v)
+
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        elif has_body and length is None:
+            self.close_connection = True
+            self.send_header("Connection", "close")
+
+        self.end_headers()
+
+        if not has_body:
+            resp.read()
+            return
+
+        buffer_size = self.server.buffer_size
+
+        while True:
+            data = resp.read1(buffer_size)
+            if not data:
+                break
+
+            if chunked:
+                self.wfile.write(b"%X\r\n" % len(data))
+                self.wfile.write(data)
+                self.wfile.write(b"\r\n")
+            else:
+                self.wfile.write(data)
+
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+        # read1 does not close a fully read Content-Length response by itself
+        resp.close()
+
+
+    def log_message(self, format, *args):
+        pass
 
 
     def do_GET(self): self._proxy()
@@ -49,25 +265,68 @@ class ReverseProxyHandler(BaseHTTPRequestHandler):
     def do_PATCH(self): self._proxy()
 
 
+class ThreadingHTTPSServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTPServer that serves each client connection on its own thread. An idle
+    keep-alive client only holds its own thread, so the TLS handshake of a new
+    client never waits for a busy worker; the handshake runs in that thread
+    and a slow client never blocks the accept loop. `workers` bounds the
+    requests relayed upstream at the same time instead.
+    """
+
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, address, handler, context, workers):
+        super().__init__(address, handler)
+        self.context = context
+        self.active = threading.BoundedSemaphore(workers)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            request.settimeout(self.RequestHandlerClass.timeout)
+            request = self.context.wrap_socket(request, server_side=True)
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        log.error("Proxy error serving %s" % (client_address,))
+
+
 def start_https_proxy(server_cfg):
 
     try:
-        httpd = HTTPServer(
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(
+            certfile=secure_cfg["cert"],
+            keyfile=secure_cfg["key"]
+        )
+
+        ReverseProxyHandler.timeout = server_cfg["channel_timeout"]
+
+        httpd = ThreadingHTTPSServer(
             (server_cfg["public_host"], server_cfg["public_port"]),
-            ReverseProxyHandler
+            ReverseProxyHandler,
+            context,
+            workers=server_cfg.get("proxy_threads", 32)
         )
 
         httpd.internal_host = server_cfg["internal_host"]
         httpd.internal_port = server_cfg["internal_port"]
 
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        context.load_cert_chain(
-            certfile=secure_cfg["cert"],
-            keyfile=secure_cfg["key"]
+        httpd.buffer_size = server_cfg.get("proxy_buffer_size", 65536)
+
+        httpd.upstream = UpstreamPool(
+            server_cfg["internal_host"],
+            server_cfg["internal_port"],
+            size=server_cfg.get("proxy_upstream_connections", server_cfg["threads"]),
+            timeout=server_cfg.get("proxy_timeout", server_cfg["channel_timeout"])
         )
 
-        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
         httpd.serve_forever()
 
     except Exception as e:
-        log.error("Error: {}".format(e))
\ No newline at end of file
+        log.error("Error: {}".format(e))
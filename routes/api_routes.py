@@ -1,9 +1,12 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit, parse_qs
 
-from flask import Flask, request, jsonify, abort, json
+from flask import Flask, Response, request, jsonify, abort, json, stream_with_context
 
 from analytics.usage_counter import increment_request
 from db import DB
+from odata.literals import InvalidQuery
 from security.password_hasher import PasswordHasher
 from security.security_provider import SecurityProvider
 from threads import server_state
@@ -45,6 +48,15 @@ permissions = secProvider.get_permissions()
 
 USER_PERMISSIONS = defaultdict(lambda: defaultdict(set))
 
+# query options passed through to the DB layer
+ODATA_OPTIONS = ("$apply", "$select", "$filter", "$top", "$skip", "$orderby", "$skiptoken", "$count", "$inlinecount")
+
+# runs the independent reads of a $batch request concurrently
+batch_executor = ThreadPoolExecutor(
+    max_workers=cfg["odata"].get("batch_workers", 8),
+    thread_name_prefix="batch"
+)
+
 def build_permission_cache():
 
     for perm in permissions:
@@ -92,7 +104,13 @@ def reload_security():
 
 def init_db(cfg, analytics):
     global db
-    db = DB(cfg, analytics)
+
+    if db is not None:
+        db.schema_watcher.stop()
+
+    # only the tables exposed by an endpoint need metadata
+    db = DB(cfg, analytics, tables=[ep["source"] for ep in endpoints if ep.get("source")])
+    db.schema_watcher.start()
 
 '''
     BASIC AUTH
@@ -116,6 +134,12 @@ def get_version():
 def health():
     return {"status": "ok", "version": __version__, "user": basic_auth.current_user()}
 
+
+@app.route("/stats")
+@basic_auth.login_required
+def stats():
+    return jsonify(db.stats())
+
 '''
     JWT AUTH
 '''
@@ -193,6 +217,10 @@ def can_access(username, endpoint_name, action):
     return action in USER_PERMISSIONS.get(username, {}).get(endpoint_name, ())
 
 
+def endpoint_keys(endpoint):
+    return [k.strip() for k in endpoint.get("primary_key", "").split(",") if k.strip()]
+
+
 @app.route("/odata/<namespace>/<endpoint_name>", methods=["GET"])
 @jwt_required()
 def odata_table(namespace, endpoint_name):
@@ -210,33 +238,255 @@ def odata_table(namespace, endpoint_name):
     table_name = endpoint["source"]
 
     args = request.args
-    params = {
-        k: args[k]
-        for k in ("$select", "$filter", "$top", "$skip", "$orderby")
-        if k in args
-    }
+    params = {k: args[k] for k in ODATA_OPTIONS if k in args}
+
+    query_key = (namespace, endpoint_name, tuple(sorted(params.items())))
+
+    # endpoints with etag enabled answer an unchanged poll with a 304,
+    # without running the query
+    headers = {}
+
+    if endpoint.get("etag"):
+        # an endpoint with a cache_ttl expires its ETags as its cached bodies
+        etag = db.etag(table_name, query_key, endpoint.get("cache_ttl"))
+        headers["ETag"] = f'"{etag}"'
+
+        if request.if_none_match.contains_weak(etag):
+            increment_request(kind="light", success=True)
+            return Response(status=304, headers=headers)
+
+    # endpoints with a cache_ttl serve repeated queries from the result cache
+    ttl = endpoint.get("cache_ttl")
+
+    if ttl:
+        body = db.result_cache.get(query_key)
+
+        if body is not None:
+            increment_request(kind="light", success=True)
+            return Response(body, mimetype="application/json", headers=headers)
+
+        # taken before the query, a write from now on invalidates this read
+        generation = db.result_cache.generation(table_name)
+
+    # identical queries in flight at the same time share the leader's body
+    flight, leader = None, False
+
+    if db.coalesce_max_bytes:
+        flight, leader = db.flights.begin(query_key)
+
+        if not leader:
+            try:
+                body = db.flights.wait(flight)
+            except InvalidQuery as e:
+                increment_request(kind="light", success=False)
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                log.error(f"OData error [{namespace}/{endpoint_name}]: {e}")
+                increment_request(kind="light", success=False)
+                return jsonify({"error": "Query execution failed"}), 500
+
+            if body is not None:
+                increment_request(kind="light", success=True)
+                return Response(body, mimetype="application/json", headers=headers)
 
     try:
-        result = db.query_odata(table_name, params)
+        result = open_read(endpoint, params)
 
-        rows = result.get("rows", [])
-        columns = result.get("columns", [])
+        columns = result["columns"]
+        batches = result["batches"]
+        page = result["page"]
+        total = result["count"]
 
-        increment_request(
-            kind="light" if len(rows) < 101 else "heavy",
-            success=True
-        )
+        # the first batch is fetched here so query errors still get a 500
+        first = next(batches, [])
 
-        return jsonify([
-            dict(zip(columns, row))
-            for row in rows
-        ])
+    except InvalidQuery as e:
+        if leader:
+            db.flights.finish(query_key, flight, error=e)
+        increment_request(kind="light", success=False)
+        return jsonify({"error": str(e)}), 400
 
     except Exception as e:
         log.error(f"OData error [{namespace}/{endpoint_name}]: {e}")
+        if leader:
+            db.flights.finish(query_key, flight, error=e)
+        increment_request(kind="light", success=False)
+        return jsonify({"error": "Query execution failed"}), 500
+
+    # the body is kept while it may still go to the result cache or followers
+    keep_limit = max(
+        db.result_cache.max_entry_bytes if ttl else 0,
+        db.coalesce_max_bytes if leader else 0
+    )
+
+    waiting = leader
+
+    def release(body=None):
+        """Ends the flight of a leader once, sharing `body` when it is small enough"""
+
+        nonlocal waiting
+        if waiting:
+            waiting = False
+            shared = body if body is not None and len(body) <= db.coalesce_max_bytes else None
+            db.flights.finish(query_key, flight, shared)
+
+    def close():
+        # also runs when the body is never read (a client gone before the
+        # first chunk, a HEAD request), the generator does not start then
+        batches.close()
+        release()
+
+    def generate():
+        count = 0
+        body = None
+        kept = [] if keep_limit else None
+        kept_size = 0
+
+        def keep(chunk):
+            nonlocal kept, kept_size
+            if kept is not None:
+                kept_size += len(chunk)
+                if kept_size <= keep_limit:
+                    kept.append(chunk)
+                else:
+                    kept = None
+
+            # too big to share: the followers run the query themselves now
+            # rather than after this client has read the whole stream
+            if kept_size > db.coalesce_max_bytes:
+                release()
+            return chunk
+
+        # paged reads and reads with $count=true answer an object
+        envelope = page is not None or total is not None
+
+        try:
+            if envelope:
+                yield keep("{" + (f'"@odata.count":{total},' if total is not None else "") + '"value":[')
+            else:
+                yield keep("[")
+
+            batch = first
+            while batch:
+                if count:
+                    yield keep(",")
+                chunk = json.dumps([dict(zip(columns, row)) for row in batch])[1:-1]
+                if page:
+                    page["sent_bytes"] += len(chunk)
+                yield keep(chunk)
+
+                count += len(batch)
+                batch = next(batches, [])
+
+            yield keep("]")
+
+            if envelope:
+                if page and page["next"]:
+                    link = next_link(request.path, request.args.to_dict(), page["next"], count)
+                    yield keep(f',"@odata.nextLink":{json.dumps(link)}')
+                yield keep("}")
+
+            if kept is not None:
+                body = "".join(kept).encode()
+                if ttl:
+                    db.result_cache.put(query_key, table_name, body, ttl, generation)
+
+            increment_request(
+                kind="light" if count < 101 else "heavy",
+                success=True
+            )
+
+        except Exception as e:
+            # the status is already sent, the client gets a truncated array
+            log.error(f"OData stream error [{namespace}/{endpoint_name}]: {e}")
+            increment_request(kind="heavy", success=False)
+
+        finally:
+            batches.close()
+            release(body)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="application/json",
+        headers=headers
+    )
+    response.call_on_close(close)
+    return response
+
+
+def open_read(endpoint, params):
+    """
+    Starts the read of an endpoint; endpoints with max_page_rows or
+    max_page_bytes are paged by the server
+    """
+
+    return db.stream_odata(
+        endpoint["source"],
+        params,
+        db.select_lane(endpoint, params),
+        keys=endpoint_keys(endpoint),
+        page_size=endpoint.get("max_page_rows"),
+        page_bytes=endpoint.get("max_page_bytes"),
+        approximate_count=endpoint.get("approximate_count", False)
+    )
+
+
+@app.route("/odata/<namespace>/<endpoint_name>/$count", methods=["GET"])
+@jwt_required()
+def odata_count(namespace, endpoint_name):
+
+    endpoint = ENDPOINT_BY_NAMESPACE.get(namespace, {}).get(endpoint_name)
+
+    if not endpoint:
+        abort(404, "Endpoint not found")
+
+    username = get_jwt_identity()
+
+    if not can_access(username, endpoint_name, "read"):
+        abort(403, "Permission denied")
+
+    try:
+        count = read_count(endpoint, request.args)
+    except InvalidQuery as e:
+        increment_request(kind="light", success=False)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error(f"OData count error [{namespace}/{endpoint_name}]: {e}")
         increment_request(kind="light", success=False)
         return jsonify({"error": "Query execution failed"}), 500
 
+    increment_request(kind="light", success=True)
+    return Response(str(count), mimetype="text/plain")
+
+
+def read_count(endpoint, args):
+    """Rows of an endpoint, after the $apply and $filter in `args`"""
+
+    params = {k: args[k] for k in ("$apply", "$filter") if k in args}
+
+    return db.count_odata(
+        endpoint["source"],
+        params,
+        db.select_lane(endpoint, params),
+        endpoint.get("approximate_count", False)
+    )
+
+
+def next_link(path, args, skiptoken, count):
+    """
+    Relative URL of the next page: the same query with the new $skiptoken,
+    no $skip, and $top reduced by the rows already sent.
+    """
+
+    args = dict(args)
+    args.pop("$skip", None)
+    args["$skiptoken"] = skiptoken
+
+    if "$top" in args:
+        args["$top"] = str(int(args["$top"]) - count)
+
+    return path + "?" + urlencode(args, safe="$,'()")
+
 
 @app.route("/odata/<namespace>/<endpoint_name>", methods=["POST"])
 @jwt_required()
@@ -253,12 +503,24 @@ def odata_insert(namespace, endpoint_name):
 
     table_name = endpoint["source"]
 
+    # a JSON array or an NDJSON body is loaded in bulk; a body that does not
+    # parse is answered with 400, outside the handler of database errors
+    body = request_rows()
+
+    if not body:
+        abort(400, "json body required")
+
     try:
-        body = request.get_json()
-        if not body:
-            abort(400, "json body required")
+        if isinstance(body, list):
+            result = db.bulk_insert_odata(table_name, body, db.select_lane(endpoint))
+        else:
+            result = db.insert_odata(
+                table_name,
+                body,
+                db.select_lane(endpoint),
+                coalesce=endpoint.get("coalesce_writes", False)
+            )
 
-        result = db.insert_odata(table_name, body)
         return jsonify(result)
 
     except Exception as e:
@@ -267,6 +529,59 @@ def odata_insert(namespace, endpoint_name):
 
 
 
+@app.route("/odata/<namespace>/<endpoint_name>", methods=["PATCH", "PUT"])
+@jwt_required()
+def odata_upsert(namespace, endpoint_name):
+    """
+    Bulk upsert keyed on the endpoint primary_key: existing rows are
+    updated with the given columns, missing ones are inserted
+    """
+
+    endpoint = ENDPOINT_BY_NAMESPACE.get(namespace, {}).get(endpoint_name)
+    if not endpoint:
+        abort(404, "Endpoint not found")
+
+    username = get_jwt_identity()
+
+    if not can_access(username, endpoint_name, "write"):
+        abort(403, "Permission denied")
+
+    table_name = endpoint["source"]
+    keys = endpoint_keys(endpoint)
+
+    body = request_rows()
+    if not body:
+        abort(400, "json body required")
+
+    try:
+        if not isinstance(body, list):
+            body = [body]
+
+        result = db.upsert_odata(table_name, body, keys, db.select_lane(endpoint))
+        return jsonify(result)
+
+    except Exception as e:
+        log.error(f"OData UPSERT error [{namespace}/{endpoint_name}]: {e}")
+        return jsonify({"error": "Upsert failed"}), 500
+
+
+def request_rows():
+    """JSON body of a write; an NDJSON body is read as a list of objects"""
+
+    if request.mimetype == "application/x-ndjson":
+        rows = []
+        for number, line in enumerate(request.get_data().splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                abort(400, f"Invalid JSON on line {number}")
+        return rows
+
+    return request.get_json()
+
+
 @app.route("/odata/<namespace>/<endpoint_name>/<id>", methods=["PATCH", "PUT"])
 @jwt_required()
 def odata_update(namespace, endpoint_name, id):
@@ -293,9 +608,10 @@ def odata_update(namespace, endpoint_name, id):
 
         result = db.update_odata(
             table_name = table_name,
-            pk_name = endpoint.get("primary_key", "id"),
-            pk_value = id,
-            data = body
+            key_column = (endpoint_keys(endpoint) or ["id"])[0],
+            key_value = id,
+            data = body,
+            lane = db.select_lane(endpoint)
         )
 
         return jsonify(result)
@@ -304,4 +620,244 @@ def odata_update(namespace, endpoint_name, id):
         log.error(f"OData UPDATE error [{namespace}/{endpoint_name}/{id}]: {e}")
         return jsonify({"error": "Update failed"}), 500
 
+@app.route("/odata/<namespace>/$batch", methods=["POST"])
+@jwt_required()
+def odata_batch(namespace):
+    """
+    OData JSON batch:
+
+        {"requests": [{"id", "method", "url", "body", "atomicityGroup"}]}
+
+    Runs of consecutive GETs execute concurrently, writes execute in order,
+    and the writes sharing an atomicityGroup run as one change set on a
+    single connection. Answers {"responses": [{"id", "status", "body"}]}.
+    """
+
+    username = get_jwt_identity()
+
+    body = request.get_json(silent=True) or {}
+    ops = body.get("requests")
+
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"error": "requests array required"}), 400
+
+    if len(ops) > cfg["odata"].get("batch_max_requests", 100):
+        return jsonify({"error": "Too many requests in batch"}), 400
+
+    if not all(isinstance(op, dict) for op in ops):
+        return jsonify({"error": "Every request must be a JSON object"}), 400
+
+    results = [None] * len(ops)
+    reads = []
+    i = 0
+
+    while i < len(ops):
+        op = ops[i]
+        group = op.get("atomicityGroup")
+
+        if group is None and str(op.get("method", "")).upper() == "GET":
+            target, error = batch_target(namespace, op, username)
+            if error:
+                results[i] = error
+            else:
+                reads.append((i, batch_executor.submit(batch_read, target)))
+            i += 1
+            continue
+
+        # reads before a write complete before it starts
+        for j, future in reads:
+            results[j] = future.result()
+        reads = []
+
+        if group is None:
+            target, error = batch_target(namespace, op, username)
+            results[i] = error or batch_write(target)
+            i += 1
+            continue
+
+        members = [i]
+        i += 1
+        while i < len(ops) and ops[i].get("atomicityGroup") == group:
+            members.append(i)
+            i += 1
+
+        for j, result in zip(members, batch_change_set(namespace, [ops[j] for j in members], username)):
+            results[j] = result
+
+    for j, future in reads:
+        results[j] = future.result()
+
+    responses = []
+    for op, (status, result) in zip(ops, results):
+        response = {"id": op.get("id"), "status": status, "body": result}
+        if op.get("atomicityGroup") is not None:
+            response["atomicityGroup"] = op["atomicityGroup"]
+        responses.append(response)
+
+    return jsonify({"responses": responses})
+
+
+def batch_target(namespace, op, username):
+    """
+    Resolves a $batch request to its endpoint. Returns (target, None), or
+    (None, (status, body)) when it is not found or not allowed.
+    """
+
+    method = str(op.get("method", "")).upper()
+    url = urlsplit(str(op.get("url", "")))
+
+    path = url.path
+    prefix = f"/odata/{namespace}/"
+    if path.startswith(prefix):
+        path = path[len(prefix):]
+
+    parts = path.strip("/").split("/")
+    endpoint_name = parts[0]
+    endpoint = ENDPOINT_BY_NAMESPACE.get(namespace, {}).get(endpoint_name)
+
+    if not endpoint or len(parts) > 2:
+        return None, (404, {"error": "Endpoint not found"})
+
+    if method not in ("GET", "POST", "PATCH", "PUT"):
+        return None, (405, {"error": "Method not allowed"})
+
+    if not can_access(username, endpoint_name, "read" if method == "GET" else "write"):
+        return None, (403, {"error": "Permission denied"})
+
+    args = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+
+    if method != "GET" and not isinstance(op.get("body"), (dict, list)):
+        return None, (400, {"error": "json body required"})
+
+    return {
+        "method": method,
+        "endpoint": endpoint,
+        "name": endpoint_name,
+        "path": f"/odata/{namespace}/{endpoint_name}",
+        "id": parts[1] if len(parts) > 1 else None,
+        "args": args,
+        "params": {k: args[k] for k in ODATA_OPTIONS if k in args},
+        "body": op.get("body")
+    }, None
+
+
+def batch_read(target):
+    """Runs on the batch executor, returns (status, body)"""
+
+    try:
+        if target["id"] == "$count":
+            count = read_count(target["endpoint"], target["args"])
+            increment_request(kind="light", success=True)
+            return 200, count
+
+        result = open_read(target["endpoint"], target["params"])
+        columns = result["columns"]
+        page = result["page"]
+        rows = []
+
+        try:
+            for batch in result["batches"]:
+                chunk = [dict(zip(columns, row)) for row in batch]
+                if page:
+                    page["sent_bytes"] += len(json.dumps(chunk))
+                rows.extend(chunk)
+        finally:
+            result["batches"].close()
+
+        increment_request(kind="light" if len(rows) < 101 else "heavy", success=True)
+
+        if page is None and result["count"] is None:
+            return 200, rows
+
+        body = {"value": rows}
+        if result["count"] is not None:
+            body = {"@odata.count": result["count"], **body}
+        if page and page["next"]:
+            body["@odata.nextLink"] = next_link(target["path"], target["args"], page["next"], len(rows))
+        return 200, body
+
+    except InvalidQuery as e:
+        increment_request(kind="light", success=False)
+        return 400, {"error": str(e)}
+
+    except Exception as e:
+        log.error(f"OData batch error [{target['path']}]: {e}")
+        increment_request(kind="light", success=False)
+        return 500, {"error": "Query execution failed"}
+
+
+def batch_write(target):
+
+    endpoint = target["endpoint"]
+    table_name = endpoint["source"]
+    body = target["body"]
+    lane = db.select_lane(endpoint)
+
+    try:
+        if target["method"] == "POST":
+            if isinstance(body, list):
+                return 200, db.bulk_insert_odata(table_name, body, lane)
+            return 200, db.insert_odata(
+                table_name, body, lane, coalesce=endpoint.get("coalesce_writes", False)
+            )
+
+        if target["id"] is not None:
+            key_column = (endpoint_keys(endpoint) or ["id"])[0]
+            return 200, db.update_odata(table_name, key_column, target["id"], body, lane)
+
+        rows = body if isinstance(body, list) else [body]
+        return 200, db.upsert_odata(table_name, rows, endpoint_keys(endpoint), lane)
+
+    except Exception as e:
+        log.error(f"OData batch error [{target['path']}]: {e}")
+        return 500, {"error": "Write failed"}
+
+
+def batch_change_set(namespace, ops, username):
+    """
+    Runs the writes of one atomicityGroup in a single transaction. Returns
+    (status, body) per request; if any of them fails, all fail.
+    """
+
+    changes = []
+    lane = None
+
+    for op in ops:
+        target, error = batch_target(namespace, op, username)
+        if error:
+            return [error] * len(ops)
+
+        if target["method"] == "GET":
+            return [(400, {"error": "GET is not allowed in an atomicityGroup"})] * len(ops)
+
+        endpoint = target["endpoint"]
+        body = target["body"]
+        rows = body if isinstance(body, list) else [body]
+        lane = lane or db.select_lane(endpoint)
+
+        if target["method"] == "POST":
+            changes.append({"kind": "insert", "table": endpoint["source"], "rows": rows})
+        elif target["id"] is not None:
+            changes.append({
+                "kind": "update",
+                "table": endpoint["source"],
+                "key_column": (endpoint_keys(endpoint) or ["id"])[0],
+                "key_value": target["id"],
+                "data": body
+            })
+        else:
+            changes.append({
+                "kind": "upsert",
+                "table": endpoint["source"],
+                "rows": rows,
+                "keys": endpoint_keys(endpoint)
+            })
+
+    try:
+        return [(200, result) for result in db.change_set(changes, lane)]
+    except Exception as e:
+        log.error(f"OData batch change set error [{namespace}]: {e}")
+        return [(500, {"error": "Change set failed"})] * len(ops)
+
+
 import routes.web_routes
\ No newline at end of file
@@ -0,0 +1,77 @@
+import threading
+
+from analytics.logger import setup_logger
+
+log = setup_logger()
+
+
+class SchemaWatcher:
+    """
+    Polls the schema fingerprint of the database every `interval` seconds
+    and reloads the metadata of `db` when it changes, so columns and tables
+    added by a DBA are served without restarting the server.
+
+    The new metadata is built aside and swapped in with a single assignment;
+    a failed reload keeps the previous metadata and is retried on the next
+    poll. An interval of 0 disables the watcher.
+    """
+
+    def __init__(self, db, interval=30):
+        self.db = db
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+        self.checks = 0
+        self.reloads = 0
+        self.errors = 0
+
+    def start(self):
+        if self.interval <= 0 or self.thread is not None:
+            return
+
+        self.thread = threading.Thread(
+            target=self._run,
+            name="schema-watcher",
+            daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """Returns True when the schema changed and the metadata was reloaded"""
+
+        try:
+            fingerprint = self.db.schema_fingerprint()
+        except Exception as e:
+            log.error("Error: {}".format(e))
+            self.errors += 1
+            return False
+
+        self.checks += 1
+
+        if fingerprint == self.db.fingerprint:
+            return False
+
+        log.info("Schema change detected, reloading metadata")
+
+        if not self.db.load_metadata():
+            self.errors += 1
+            return False
+
+        self.reloads += 1
+        return True
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "running": self.thread is not None and not self.stopped.is_set(),
+            "checks": self.checks,
+            "reloads": self.reloads,
+            "errors": self.errors
+        }
@@ -0,0 +1,167 @@
+"""
+ConnectionPool bursts past its size up to max_overflow, shrinks back when
+the load goes, and evicts broken connections. Runs on fake connections,
+without a database.
+"""
+import threading
+import time
+
+import pytest
+
+from db_pool import ConnectionPool
+
+
+class Connection:
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Factory:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = []
+
+    def __call__(self):
+        with self.lock:
+            conn = Connection(len(self.opened))
+            self.opened.append(conn)
+            return conn
+
+
+def settle(pool, idle):
+    """Waits for the background replacements to reach `idle` idle connections"""
+
+    deadline = time.monotonic() + 2
+    while pool.status()["idle"] != idle:
+        assert time.monotonic() < deadline, pool.status()
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def factory():
+    return Factory()
+
+
+def pool_of(factory, **kwargs):
+    kwargs.setdefault("size", 2)
+    kwargs.setdefault("max_overflow", 2)
+    kwargs.setdefault("timeout", 0.2)
+    return ConnectionPool(factory, is_closed=lambda conn: conn.closed, **kwargs)
+
+
+def test_burst_up_to_overflow(factory):
+    pool = pool_of(factory)
+
+    conns = [pool.acquire() for _ in range(4)]
+
+    assert len({id(c) for c in conns}) == 4
+    assert pool.status()["opened"] == 4
+
+    with pytest.raises(Exception, match="exhausted"):
+        pool.acquire(timeout=0.05)
+
+    for conn in conns:
+        pool.release(conn)
+
+    # the overflow connections are closed, the pool is back to its size
+    status = pool.status()
+    assert status["opened"] == 2
+    assert status["idle"] == 2
+    assert sum(c.closed for c in conns) == 2
+
+
+def test_waiter_gets_released_connection(factory):
+    pool = pool_of(factory, max_overflow=0, timeout=2)
+    conns = [pool.acquire() for _ in range(2)]
+    got = []
+
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    assert not got
+
+    pool.release(conns[0])
+    waiter.join(2)
+
+    assert got == [conns[0]]
+    assert len(factory.opened) == 2
+
+
+def test_lazy_open_below_min_size(factory):
+    pool = pool_of(factory, size=4, min_size=1)
+
+    assert len(factory.opened) == 1
+
+    pool.acquire()
+
+    # taking the last idle connection opens a replacement in the background
+    settle(pool, 1)
+    assert pool.status()["opened"] == 2
+
+
+def test_broken_connection_is_evicted(factory):
+    pool = pool_of(factory)
+    conn = pool.acquire()
+
+    pool.release(conn, broken=True)
+
+    assert conn.closed
+    assert pool.status()["evictions"] == 1
+
+    # the slot is kept for a replacement, the broken one is never handed out
+    settle(pool, 2)
+    assert pool.status()["opened"] == 2
+    assert all(pool.acquire() is not conn for _ in range(2))
+
+
+def test_broken_overflow_connection_frees_its_slot(factory):
+    pool = pool_of(factory)
+    conns = [pool.acquire() for _ in range(3)]
+
+    pool.release(conns[2], broken=True)
+
+    assert pool.status()["opened"] == 2
+    assert pool.status()["evictions"] == 1
+
+
+def test_closed_connection_replaced_on_checkout(factory):
+    pool = pool_of(factory, max_overflow=0)
+    conns = [pool.acquire() for _ in range(2)]
+    for conn in conns:
+        pool.release(conn)
+
+    conns[1].closed = True
+    conn = pool.acquire()
+
+    assert conn is not conns[1]
+    assert not conn.closed
+    assert pool.status()["evictions"] == 1
+
+
+def test_failed_open_gives_back_its_slot(factory):
+    pool = pool_of(factory, max_overflow=0)
+    conns = [pool.acquire() for _ in range(2)]
+    pool.release(conns[0], broken=True)
+    settle(pool, 1)
+
+    def fail():
+        raise ConnectionError("refused")
+
+    pool.factory = fail
+    pool.release(conns[1], broken=True)
+
+    # the replacement fails: its slot is free again for a later checkout
+    deadline = time.monotonic() + 2
+    while pool.status()["opened"] != 1:
+        assert time.monotonic() < deadline, pool.status()
+        time.sleep(0.01)
+
+    pool.factory = factory
+    assert pool.acquire() is not None
+    assert pool.acquire() is not None
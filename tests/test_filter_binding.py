@@ -0,0 +1,70 @@
+"""
+$filter literals are converted to the types of the columns they are compared
+with, so the database compares typed values and can seek its indexes.
+Builds plans from in-memory metadata, without a database.
+"""
+import datetime
+import decimal
+
+import pytest
+
+from db import DB, Meta
+from db_pool import PostgresAdapter
+
+COLUMNS = {
+    "OrderID": {"type": "int", "nullable": False, "pk": True},
+    "Freight": {"type": "money", "nullable": True, "pk": False},
+    "OrderDate": {"type": "datetime", "nullable": True, "pk": False},
+    "ShipName": {"type": "nvarchar", "nullable": True, "pk": False},
+}
+
+
+@pytest.fixture
+def db():
+    db = DB.__new__(DB)
+    db.cfg = {"active_dialect": "postgres", "odata": {}}
+    db.meta = Meta()
+    db.meta.tables["Orders"] = {"columns": COLUMNS}
+    db.adapter = PostgresAdapter.__new__(PostgresAdapter)
+    return db
+
+
+def bound(db, params):
+    """The converters of the plan and the values they bind"""
+
+    key, literals = db._query_shape("Orders", params)
+    _, slots, converters, _ = db._build_plan("Orders", key)
+    values = [literals[i] if c is None else c(literals[i]) for i, c in zip(slots, converters)]
+    return converters, values
+
+
+@pytest.mark.parametrize("filter_str, expected", [
+    ("OrderID eq 10250", 10250),
+    ("Freight gt 10.5", decimal.Decimal("10.5")),
+    ("OrderDate ge 1998-05-01T10:30:00", datetime.datetime(1998, 5, 1, 10, 30)),
+    ("OrderDate lt 1998-05-01", datetime.datetime(1998, 5, 1)),
+])
+def test_typed_columns(db, filter_str, expected):
+    converters, values = bound(db, {"$filter": filter_str})
+
+    assert converters[0] is not None
+    assert values == [expected]
+    assert type(values[0]) is type(expected)
+
+
+def test_text_columns_bind_unchanged(db):
+    converters, values = bound(db, {"$filter": "ShipName eq '10250'"})
+
+    assert converters == [None]
+    assert values == ["10250"]
+
+
+def test_literal_order_follows_placeholders(db):
+    _, values = bound(db, {"$filter": "ShipName eq 'x' and OrderID in (1, 2)", "$top": "5"})
+
+    assert values == ["x", 1, 2, 5]
+
+
+def test_invalid_literal_is_rejected(db):
+    with pytest.raises(RuntimeError, match="Invalid literal"):
+        bound(db, {"$filter": "OrderID eq 'abc'"})
@@ -0,0 +1,157 @@
+"""
+A $filter on an indexed column, with its literals bound as typed values as
+the server binds them, must get an index seek instead of a scan.
+
+The plan check needs a database: TEST_DB_CONFIG names a config.json whose
+active_dialect points to a database where the test may create the table
+index_seeks. Postgres plans are taken with sequential scans disabled, so the
+small table still shows whether its index can be used. Skipped without it.
+"""
+import datetime
+import json
+import os
+import re
+
+import pytest
+
+from db import DB
+
+TABLE = "index_seeks"
+
+ROWS = [
+    {
+        "id": i,
+        "code": f"C{i}",
+        "created": datetime.date(2024, 1, 1) + datetime.timedelta(days=i),
+        "amount": f"{i}.25",
+    }
+    for i in range(1, 201)
+]
+
+# MySQL EXPLAIN access types that look rows up through an index
+MYSQL_SEEKS = {"const", "eq_ref", "ref", "ref_or_null", "range", "index_merge", "unique_subquery"}
+
+# the access type column, not select_type
+MYSQL_TYPE = re.compile(r"(?<![_\w])type=(\w+)")
+
+
+class Analytics:
+
+    def capture(self, *args, **kwargs):
+        pass
+
+    def capture_error(self, *args, **kwargs):
+        pass
+
+
+def seeks(dialect, lines):
+    """Whether a plan looks rows up through an index instead of scanning"""
+
+    text = "\n".join(lines)
+
+    if dialect == "mssql":
+        return "Index Seek" in text and "Scan(" not in text
+    if dialect == "mysql":
+        types = [MYSQL_TYPE.search(line) for line in lines]
+        return all(t is not None and t.group(1) in MYSQL_SEEKS for t in types)
+    return "Index Cond" in text and "Seq Scan" not in text
+
+
+def test_mysql_access_type_is_not_select_type():
+    seek = "id=1 select_type=SIMPLE table=orders partitions=None type=const possible_keys=PRIMARY"
+    scan = "id=1 select_type=SIMPLE table=orders partitions=None type=ALL possible_keys=None"
+
+    assert seeks("mysql", [seek])
+    assert not seeks("mysql", [scan])
+    assert not seeks("mysql", [seek, scan])
+
+
+def ddl(db, sql):
+    # DDL cannot go through the prepared statement path of db.execute
+    conn = db.adapter.acquire()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql)
+    finally:
+        cur.close()
+        db.adapter.release(conn)
+
+
+def explain(db, sql, params):
+    conn = db.adapter.acquire()
+    cur = conn.cursor()
+
+    try:
+        if db.cfg["active_dialect"] == "mssql":
+            cur.execute("SET SHOWPLAN_TEXT ON")
+            try:
+                cur.execute(sql, params)
+                lines = []
+                while True:
+                    lines += [str(row[0]) for row in cur.fetchall()]
+                    if not cur.nextset():
+                        break
+            finally:
+                cur.execute("SET SHOWPLAN_TEXT OFF")
+        elif db.cfg["active_dialect"] == "mysql":
+            cur.execute("EXPLAIN " + sql, params)
+            names = [d[0] for d in cur.description]
+            lines = [
+                " ".join(f"{n}={v}" for n, v in (row.items() if isinstance(row, dict) else zip(names, row)))
+                for row in cur.fetchall()
+            ]
+        else:
+            cur.execute("SET enable_seqscan = off")
+            try:
+                cur.execute("EXPLAIN " + sql, params)
+                lines = [" | ".join(str(v) for v in row) for row in cur.fetchall()]
+            finally:
+                cur.execute("RESET enable_seqscan")
+    finally:
+        cur.close()
+        db.adapter.release(conn)
+
+    return lines
+
+
+@pytest.fixture(scope="module")
+def db():
+    path = os.environ.get("TEST_DB_CONFIG")
+    if not path:
+        pytest.skip("TEST_DB_CONFIG is not set")
+
+    with open(path) as f:
+        cfg = json.load(f)
+
+    cfg["odata"].update(pool_min_size=1, metadata_cache=False, count_cache_ttl=0)
+    db = DB(cfg, Analytics(), [TABLE])
+
+    ddl(db, f"DROP TABLE IF EXISTS {TABLE}")
+    ddl(db, f"CREATE TABLE {TABLE} (id INT NOT NULL PRIMARY KEY, code VARCHAR(20) NOT NULL, "
+            f"created DATE NOT NULL, amount DECIMAL(10, 2) NOT NULL)")
+    ddl(db, f"CREATE INDEX {TABLE}_code ON {TABLE} (code)")
+    ddl(db, f"CREATE INDEX {TABLE}_created ON {TABLE} (created)")
+    ddl(db, f"CREATE INDEX {TABLE}_amount ON {TABLE} (amount)")
+    db.load_metadata()
+    db.bulk_insert_odata(TABLE, ROWS)
+
+    yield db
+
+    ddl(db, f"DROP TABLE {TABLE}")
+
+
+@pytest.mark.parametrize("filter_str", [
+    "id eq 7",
+    "id ge 190",
+    "code eq 'C7'",
+    "created ge 2024-07-01",
+    "amount eq 7.25",
+])
+def test_typed_filter_seeks(db, filter_str):
+    key, literals = db._query_shape(TABLE, {"$filter": filter_str})
+    sql, slots, converters, _ = db._build_plan(TABLE, key)
+    params = [literals[i] if c is None else c(literals[i]) for i, c in zip(slots, converters)]
+
+    plan = explain(db, sql, params)
+
+    assert seeks(db.cfg["active_dialect"], plan), "\n".join(plan)
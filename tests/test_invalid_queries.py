@@ -0,0 +1,145 @@
+"""
+A query the client got wrong is answered with 400, by the read route, by
+/$count and by the reads of a $batch, and an NDJSON write with a line that
+is not JSON too. These requests fail before they reach the database, so the
+routes run on in-memory metadata without one.
+"""
+import base64
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from cache.plan_cache import PlanCache
+from cache.result_cache import ResultCache
+from cache.single_flight import SingleFlight
+from db import DB, Meta
+from db_pool import PostgresAdapter
+from routes import api_routes
+from threads import server_state
+
+NAMESPACE = "tests"
+ENDPOINT = "invalid_orders"
+USER = "invalid_tester"
+
+COLUMNS = {
+    "OrderID": {"type": "int", "nullable": False, "pk": True},
+    "Freight": {"type": "money", "nullable": True, "pk": False},
+    "OrderDate": {"type": "datetime", "nullable": True, "pk": False},
+    "ShipName": {"type": "nvarchar", "nullable": True, "pk": False},
+}
+
+
+class Analytics:
+
+    def capture(self, *args, **kwargs):
+        pass
+
+    def capture_error(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def db():
+    db = DB.__new__(DB)
+    db.cfg = {"active_dialect": "postgres", "odata": {}}
+    db.analytics = Analytics()
+    db.meta = Meta()
+    db.meta.tables["Orders"] = {"columns": COLUMNS}
+    # without a pool: a request reaching the database fails with a 500
+    db.adapter = PostgresAdapter.__new__(PostgresAdapter)
+    db.plan_cache = PlanCache(16)
+    db.result_cache = ResultCache()
+    db.flights = SingleFlight(1)
+    db.coalesce_max_bytes = 4 * 2**20
+    db.row_bytes = {}
+    return db
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setattr(api_routes, "db", db)
+    monkeypatch.setattr(server_state, "running", True)
+    monkeypatch.setitem(api_routes.ENDPOINT_BY_NAMESPACE, NAMESPACE, {
+        ENDPOINT: {"name": ENDPOINT, "namespace": NAMESPACE, "source": "Orders", "max_page_rows": 10}
+    })
+    api_routes.USER_PERMISSIONS[USER][ENDPOINT].update({"read", "write"})
+
+    with api_routes.app.app_context():
+        token = create_access_token(identity=USER)
+
+    client = api_routes.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+
+    yield client
+
+    api_routes.USER_PERMISSIONS.pop(USER)
+
+
+def token(values):
+    return base64.urlsafe_b64encode(values.encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("query, message", [
+    ("$filter=OrderID eq", "Invalid $filter"),
+    ("$filter=Nope eq 1", "Invalid $filter"),
+    ("$filter=OrderID eq 'abc'", "Invalid literal"),
+    ("$filter=OrderDate ge 1998-13-45", "Invalid literal"),
+    ("$apply=groupby(", "Invalid $"),
+    ("$apply=bogus(OrderID)", "Invalid $apply"),
+    ("$apply=aggregate(Freight with median as Total)", "Invalid $apply"),
+    ("$select=Nope", "No valid columns"),
+    ("$skiptoken=not-a-token", "Invalid $skiptoken"),
+    (f"$skiptoken={token('[[1]]')}", "Invalid $skiptoken"),
+    (f"$skiptoken={token('[1, 2]')}", "Invalid $skiptoken"),
+    (f"$skiptoken={token('[1]')}&$apply=filter(OrderID gt 1)&$filter=OrderID eq 'x'", "Invalid literal"),
+    (f"$skiptoken={token('[-1]')}&$apply=filter(OrderID gt 1)", "Invalid $skiptoken"),
+])
+def test_read_answers_400(client, db, query, message):
+    response = client.get(f"/odata/{NAMESPACE}/{ENDPOINT}?{query}")
+
+    assert response.status_code == 400, response.data
+    assert message in response.get_json()["error"]
+    # the flight of the failed read is over, the next identical read leads
+    assert db.flights.stats()["in_flight"] == 0
+
+
+@pytest.mark.parametrize("query", [
+    "$filter=OrderID eq",
+    "$filter=Freight gt ten",
+    "$apply=filter(",
+])
+def test_count_answers_400(client, query):
+    response = client.get(f"/odata/{NAMESPACE}/{ENDPOINT}/$count?{query}")
+
+    assert response.status_code == 400, response.data
+    assert "Invalid" in response.get_json()["error"]
+
+
+def test_batch_reads_answer_400(client):
+    response = client.post(f"/odata/{NAMESPACE}/$batch", json={"requests": [
+        {"id": "1", "method": "GET", "url": f"{ENDPOINT}?$filter=OrderID eq 'x'"},
+        {"id": "2", "method": "GET", "url": f"{ENDPOINT}/$count?$apply=bogus()"},
+        {"id": "3", "method": "GET", "url": f"{ENDPOINT}?$skiptoken=zz"},
+    ]})
+
+    assert response.status_code == 200
+    responses = {r["id"]: r for r in response.get_json()["responses"]}
+    assert {i: r["status"] for i, r in responses.items()} == {"1": 400, "2": 400, "3": 400}
+
+
+def test_ndjson_line_not_json_answers_400(client):
+    response = client.post(
+        f"/odata/{NAMESPACE}/{ENDPOINT}",
+        data=b'{"OrderID": 1}\n{"OrderID": \n',
+        content_type="application/x-ndjson"
+    )
+
+    assert response.status_code == 400
+    assert b"line 2" in response.data
+
+
+def test_query_reaching_the_database_is_500(client):
+    # the fake database has no pool: this is the server failing, not the client
+    response = client.get(f"/odata/{NAMESPACE}/{ENDPOINT}?$filter=OrderID eq 1")
+
+    assert response.status_code == 500
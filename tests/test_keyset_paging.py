@@ -0,0 +1,90 @@
+"""
+Keyset paging over a nullable $orderby column must return every row exactly
+once, whatever the dialect sorts NULLs as.
+
+Needs a database: TEST_DB_CONFIG names a config.json whose active_dialect
+points to a database where the test may create the table keyset_nulls.
+Skipped without it.
+"""
+import json
+import os
+
+import pytest
+
+from db import DB
+
+TABLE = "keyset_nulls"
+
+# every third score is NULL, the others repeat so ties cross page boundaries
+ROWS = [{"id": i, "score": None if i % 3 == 0 else i % 4} for i in range(1, 32)]
+
+
+class Analytics:
+
+    def capture(self, *args, **kwargs):
+        pass
+
+    def capture_error(self, *args, **kwargs):
+        pass
+
+
+def ddl(db, sql):
+    # DDL cannot go through the prepared statement path of db.execute
+    conn = db.adapter.acquire()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql)
+    finally:
+        cur.close()
+        db.adapter.release(conn)
+
+
+@pytest.fixture(scope="module")
+def db():
+    path = os.environ.get("TEST_DB_CONFIG")
+    if not path:
+        pytest.skip("TEST_DB_CONFIG is not set")
+
+    with open(path) as f:
+        cfg = json.load(f)
+
+    cfg["odata"].update(pool_min_size=1, metadata_cache=False, count_cache_ttl=0)
+    db = DB(cfg, Analytics(), [TABLE])
+
+    ddl(db, f"DROP TABLE IF EXISTS {TABLE}")
+    ddl(db, f"CREATE TABLE {TABLE} (id INT NOT NULL PRIMARY KEY, score INT NULL)")
+    db.load_metadata()
+    db.bulk_insert_odata(TABLE, ROWS)
+
+    yield db
+
+    ddl(db, f"DROP TABLE {TABLE}")
+
+
+def read_pages(db, orderby, page_size):
+    ids = []
+    token = None
+
+    for _ in range(len(ROWS) + 2):
+        params = {"$orderby": orderby}
+        if token:
+            params["$skiptoken"] = token
+
+        result = db.stream_odata(TABLE, params, page_size=page_size)
+        position = result["columns"].index("id")
+        for batch in result["batches"]:
+            ids.extend(row[position] for row in batch)
+
+        token = result["page"]["next"]
+        if token is None:
+            return ids
+
+    raise AssertionError("paging did not end")
+
+
+@pytest.mark.parametrize("orderby", ["score", "score desc", "score asc,id desc"])
+@pytest.mark.parametrize("page_size", [1, 4, 7])
+def test_every_row_once(db, orderby, page_size):
+    ids = read_pages(db, orderby, page_size)
+
+    assert sorted(ids) == [row["id"] for row in ROWS]
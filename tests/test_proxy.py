@@ -0,0 +1,89 @@
+"""
+The HTTPS proxy keeps client connections alive; idle ones must not keep new
+clients from being served, whatever `proxy_threads` is.
+"""
+import socket
+import ssl
+import threading
+from http.client import HTTPSConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import proxy
+from certs.admin_certs import generate_ca, generate_server_cert, save_pem
+
+WORKERS = 2
+
+
+class Upstream(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def proxy_port(tmp_path):
+    ca_key, ca_cert = generate_ca()
+    save_pem(tmp_path, *generate_server_cert(ca_key, ca_cert, "127.0.0.1"))
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(tmp_path / "cert.pem", tmp_path / "key.pem")
+
+    upstream = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    proxy.ReverseProxyHandler.timeout = 30
+    httpd = proxy.ThreadingHTTPSServer(("127.0.0.1", 0), proxy.ReverseProxyHandler, context, WORKERS)
+    httpd.buffer_size = 65536
+    httpd.upstream = proxy.UpstreamPool("127.0.0.1", upstream.server_address[1], size=WORKERS, timeout=5)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    yield httpd.server_address[1]
+
+    httpd.shutdown()
+    httpd.server_close()
+    upstream.shutdown()
+    upstream.server_close()
+
+
+def client(port):
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return HTTPSConnection("127.0.0.1", port, context=ctx, timeout=3)
+
+
+def get(conn):
+    conn.request("GET", "/version")
+    resp = conn.getresponse()
+    return resp.status, resp.read()
+
+
+def test_idle_keepalive_clients_do_not_block_new_ones(proxy_port):
+    # more idle keep-alive connections than workers, each after one request
+    idle = [client(proxy_port) for _ in range(WORKERS + 2)]
+    for conn in idle:
+        assert get(conn) == (200, b"ok")
+
+    # a new client still gets its TLS handshake and its answer
+    fresh = client(proxy_port)
+    try:
+        assert get(fresh) == (200, b"ok")
+    except socket.timeout:
+        pytest.fail("new client starved by idle keep-alive connections")
+    finally:
+        fresh.close()
+
+    # and the idle ones are still usable
+    for conn in idle:
+        assert get(conn) == (200, b"ok")
+        conn.close()
@@ -0,0 +1,146 @@
+"""
+ResultCache entries expire, are dropped by writes to their table and never
+outgrow the cache; the ETag of a read changes with the same events.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import db as db_module
+from cache import result_cache
+from cache.result_cache import ResultCache
+from db import DB
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache, "time", SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(db_module, "time", SimpleNamespace(time=clock))
+    return clock
+
+
+@pytest.fixture
+def cache():
+    return ResultCache(max_bytes=100, max_entry_bytes=40)
+
+
+def test_hit_until_ttl(cache, clock):
+    cache.put("q", "orders", b"body", 10, cache.generation("orders"))
+
+    clock.now += 9
+    assert cache.get("q") == b"body"
+
+    clock.now += 2
+    assert cache.get("q") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_write_drops_table_entries(cache, clock):
+    cache.put("q1", "orders", b"orders", 10, cache.generation("orders"))
+    cache.put("q2", "items", b"items", 10, cache.generation("items"))
+
+    cache.invalidate("orders")
+
+    assert cache.get("q1") is None
+    assert cache.get("q2") == b"items"
+
+
+def test_read_older_than_write_is_not_stored(cache, clock):
+    generation = cache.generation("orders")
+    cache.invalidate("orders")
+
+    cache.put("q", "orders", b"stale", 10, generation)
+
+    assert cache.get("q") is None
+
+
+def test_read_older_than_clear_is_not_stored(cache, clock):
+    generation = cache.generation("orders")
+    cache.clear()
+
+    cache.put("q", "orders", b"stale", 10, generation)
+
+    assert cache.get("q") is None
+
+
+def test_evicts_least_recently_used(cache, clock):
+    for i in range(3):
+        cache.put(f"q{i}", "orders", b"x" * 30, 10, cache.generation("orders"))
+
+    # q0 is used, q1 is now the oldest
+    cache.get("q0")
+    cache.put("q3", "orders", b"x" * 30, 10, cache.generation("orders"))
+
+    assert cache.get("q1") is None
+    assert cache.get("q0") is not None
+    assert cache.stats()["bytes"] <= 100
+
+
+def test_large_entry_is_not_stored(cache, clock):
+    cache.put("q", "orders", b"x" * 41, 10, cache.generation("orders"))
+
+    assert cache.get("q") is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.fixture
+def db(clock):
+    db = DB.__new__(DB)
+    db.cfg = {"active_dialect": "postgres", "odata": {"etag_ttl": 60}}
+    db.instance = "instance"
+    db.result_cache = ResultCache()
+    return db
+
+
+def test_etag_stable_between_writes(db, clock):
+    etag = db.etag("orders", ("q",))
+
+    clock.now += 1
+    assert db.etag("orders", ("q",)) == etag
+    assert db.etag("orders", ("other",)) != etag
+
+
+def test_etag_changes_on_write(db, clock):
+    etag = db.etag("orders", ("q",))
+
+    db.result_cache.invalidate("items")
+    assert db.etag("orders", ("q",)) == etag
+
+    db.result_cache.invalidate("orders")
+    assert db.etag("orders", ("q",)) != etag
+
+
+def test_etag_changes_on_metadata_reload(db, clock):
+    etag = db.etag("orders", ("q",))
+
+    db.result_cache.clear()
+
+    assert db.etag("orders", ("q",)) != etag
+
+
+def test_etag_expires_after_ttl(db, clock):
+    clock.now = 6000.0
+    etag = db.etag("orders", ("q",))
+
+    clock.now += 59
+    assert db.etag("orders", ("q",)) == etag
+
+    clock.now += 1
+    assert db.etag("orders", ("q",)) != etag
+
+    # an endpoint cache_ttl replaces odata.etag_ttl
+    clock.now = 6000.0
+    short = db.etag("orders", ("q",), ttl=10)
+    clock.now += 10
+    assert db.etag("orders", ("q",), ttl=10) != short
@@ -0,0 +1,117 @@
+"""
+Statement cache of the Postgres adapter: what goes through PREPARE and what
+runs unprepared.
+"""
+import itertools
+import json
+import os
+
+import pytest
+
+from db_pool import PostgresAdapter
+
+
+class Cursor:
+
+    def __init__(self, log):
+        self.log = log
+        self.description = None
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+
+    def close(self):
+        pass
+
+
+class Connection:
+
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return Cursor(self.log)
+
+
+class Analytics:
+
+    def capture(self, *args, **kwargs):
+        pass
+
+    def capture_error(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def adapter():
+    adapter = PostgresAdapter.__new__(PostgresAdapter)
+    adapter.statement_ids = itertools.count(1)
+    adapter.statements = {}
+    adapter.statement_cache_size = 4
+    adapter.unpreparable = set()
+    return adapter
+
+
+def prepares(conn):
+    return [sql for sql in conn.log if sql.startswith("PREPARE")]
+
+
+def test_repeated_statement_is_prepared_once(adapter):
+    conn = Connection()
+    sql = "SELECT a FROM t WHERE id = %s"
+
+    for i in range(3):
+        adapter.run(conn, sql, [i])
+
+    assert len(prepares(conn)) == 1
+    assert conn.log.count(sql) == 0
+
+
+def test_multi_row_inserts_run_unprepared(adapter):
+    conn = Connection()
+
+    for rows in (2, 3, 5):
+        values = ", ".join(["(%s, %s)"] * rows)
+        adapter.run(conn, f"INSERT INTO t (a, b) VALUES {values}", list(range(rows * 2)))
+
+    assert prepares(conn) == []
+    assert adapter.statements.get(id(conn), {}) == {}
+
+
+def test_single_row_insert_is_prepared(adapter):
+    conn = Connection()
+    adapter.run(conn, "INSERT INTO t (a, b) VALUES (%s, %s)", [1, 2])
+
+    assert len(prepares(conn)) == 1
+
+
+@pytest.fixture(scope="module")
+def postgres():
+    path = os.environ.get("TEST_DB_CONFIG")
+    if not path:
+        pytest.skip("TEST_DB_CONFIG is not set")
+
+    with open(path) as f:
+        cfg = json.load(f)
+    if cfg["active_dialect"] != "postgres":
+        pytest.skip("TEST_DB_CONFIG is not a Postgres database")
+
+    cfg["odata"]["pool_min_size"] = 1
+    return PostgresAdapter(cfg, Analytics())
+
+
+@pytest.mark.parametrize("sql, params, expected", [
+    ("SELECT CONCAT(%s, %s)", ["a", "b"], "ab"),
+    ("SELECT %s IS NULL", ["x"], False),
+])
+def test_statement_prepare_rejects_runs_unprepared(postgres, sql, params, expected):
+    conn = postgres.acquire()
+    try:
+        for _ in range(2):
+            cur, _ = postgres.run(conn, sql, params)
+            assert cur.fetchall() == [(expected,)]
+            cur.close()
+    finally:
+        postgres.release(conn)
+
+    assert sql in postgres.unpreparable
@@ -0,0 +1,107 @@
+"""
+WriteCoalescer groups concurrent writes of a key into one flush and hands
+every caller the result of its own row.
+"""
+import threading
+
+import pytest
+
+from write_coalescer import WriteCoalescer
+
+
+class Flush:
+
+    def __init__(self, fail=None):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, key, rows):
+        with self.lock:
+            self.calls.append((key, list(rows)))
+
+        if self.fail == "all":
+            raise RuntimeError("flush failed")
+
+        return [ValueError(f"bad row {row}") if row == self.fail else (key, row) for row in rows]
+
+
+def submit_all(coalescer, items):
+    """Submits (key, row) pairs from one thread each, returns their outcomes"""
+
+    results = [None] * len(items)
+    start = threading.Barrier(len(items))
+
+    def run(i, key, row):
+        start.wait()
+        try:
+            results[i] = coalescer.submit(key, row)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, *item)) for i, item in enumerate(items)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    return results
+
+
+def test_concurrent_rows_share_one_flush():
+    flush = Flush()
+    coalescer = WriteCoalescer(flush, max_rows=100, max_wait=0.2)
+
+    results = submit_all(coalescer, [("orders", i) for i in range(10)])
+
+    assert results == [("orders", i) for i in range(10)]
+    assert len(flush.calls) == 1
+    assert sorted(flush.calls[0][1]) == list(range(10))
+    assert coalescer.stats()["rows_per_flush"] == 10
+
+
+def test_full_batch_flushes_early():
+    flush = Flush()
+    coalescer = WriteCoalescer(flush, max_rows=4, max_wait=5)
+
+    results = submit_all(coalescer, [("orders", i) for i in range(8)])
+
+    assert results == [("orders", i) for i in range(8)]
+    assert [len(rows) for _, rows in flush.calls] == [4, 4]
+
+
+def test_keys_flush_separately():
+    flush = Flush()
+    coalescer = WriteCoalescer(flush, max_rows=100, max_wait=0.1)
+
+    results = submit_all(coalescer, [("orders", 1), ("items", 2), ("orders", 3), ("items", 4)])
+
+    assert results == [("orders", 1), ("items", 2), ("orders", 3), ("items", 4)]
+    assert sorted(key for key, _ in flush.calls) == ["items", "orders"]
+
+
+def test_failed_row_only_fails_its_caller():
+    flush = Flush(fail=2)
+    coalescer = WriteCoalescer(flush, max_rows=100, max_wait=0.1)
+
+    results = submit_all(coalescer, [("orders", i) for i in range(4)])
+
+    assert isinstance(results[2], ValueError)
+    assert [r for i, r in enumerate(results) if i != 2] == [("orders", 0), ("orders", 1), ("orders", 3)]
+
+
+def test_failed_flush_fails_every_caller():
+    coalescer = WriteCoalescer(Flush(fail="all"), max_rows=100, max_wait=0.1)
+
+    results = submit_all(coalescer, [("orders", i) for i in range(3)])
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_single_writer_waits_at_most_max_wait():
+    flush = Flush()
+    coalescer = WriteCoalescer(flush, max_rows=100, max_wait=0.01)
+
+    assert coalescer.submit("orders", 1) == ("orders", 1)
+    with pytest.raises(ValueError):
+        WriteCoalescer(Flush(fail=1), max_wait=0.01).submit("orders", 1)
@@ -0,0 +1,78 @@
+import threading
+
+
+class _Batch:
+
+    def __init__(self):
+        self.rows = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+
+
+class WriteCoalescer:
+    """
+    Groups concurrent writes that share a key into one call of
+    `flush(key, rows)`, which returns one result per row (an exception for
+    the rows that failed).
+
+    The first writer of a key waits up to `max_wait` seconds, or until
+    `max_rows` rows have joined, then flushes the batch itself; the others
+    block until it is done. Every caller gets the result of its own row.
+    """
+
+    def __init__(self, flush, max_rows=100, max_wait=0.005):
+        self.flush = flush
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flushes = 0
+        self.rows = 0
+
+    def submit(self, key, row):
+
+        with self.lock:
+            batch = self.pending.get(key)
+            leader = batch is None
+
+            if leader:
+                batch = self.pending[key] = _Batch()
+
+            slot = len(batch.rows)
+            batch.rows.append(row)
+
+            if len(batch.rows) >= self.max_rows:
+                del self.pending[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.max_wait)
+
+            with self.lock:
+                if self.pending.get(key) is batch:
+                    del self.pending[key]
+                self.flushes += 1
+                self.rows += len(batch.rows)
+
+            try:
+                batch.results = self.flush(key, batch.rows)
+            except Exception as e:
+                batch.results = [e] * len(batch.rows)
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        result = batch.results[slot]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                "flushes": self.flushes,
+                "rows": self.rows,
+                "rows_per_flush": self.rows / self.flushes if self.flushes else 0.0
+            }